@@ -0,0 +1,204 @@
+from __future__ import print_function, division
+
+''' A benchmark of the training and prediction hot paths of simple_ml and SimpleDecisionTree
+
+Usage examples:
+    python benchmark_simple_ml.py --num-instances 100000 --output results.json
+    python benchmark_simple_ml.py --num-instances 100000 --baseline results.json --tolerance 0.2
+'''
+
+__author__ = 'Joe McCarthy'
+__email__ = 'joe@interrelativity.com'
+
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from collections import defaultdict
+from timeit import default_timer
+
+import simple_ml
+from simple_decision_tree import SimpleDecisionTree
+
+
+def generate_instances(source_instances, num_instances, num_attributes=None, max_values=None,
+                       class_skew=None, noise=0.0, class_index=0, seed=0):
+    '''Returns a list of num_instances synthetic instances, shaped like source_instances.
+
+    Each synthetic instance is a copy of a randomly chosen source instance, which is then perturbed:
+        num_attributes (not counting the class) attributes are kept; if there are fewer in the source,
+            copies of randomly chosen source attributes are appended
+        the values of each attribute are folded into at most max_values distinct values
+        with probability noise, each attribute value is replaced by another value of that attribute
+    If class_skew is provided, it is the proportion of instances with the most common class label
+    (the others are shared equally by the other labels).'''
+    rng = random.Random(seed)
+    num_source_attributes = len(source_instances[0])
+    attribute_indexes = [i for i in range(num_source_attributes) if i != class_index]
+    if num_attributes is not None:
+        attribute_indexes = attribute_indexes[:num_attributes]
+        while len(attribute_indexes) < num_attributes:
+            attribute_indexes.append(rng.choice(attribute_indexes[:num_source_attributes - 1]))
+    attribute_values = [sorted(simple_ml.attribute_values(source_instances, i)) for i in attribute_indexes]
+    if max_values is not None:
+        attribute_values = [values[:max_values] for values in attribute_values]
+    # map each source value onto one of the (at most max_values) values kept for its attribute
+    value_maps = [dict((value, values[j % len(values)])
+                       for j, value in enumerate(sorted(simple_ml.attribute_values(source_instances, i))))
+                  for i, values in zip(attribute_indexes, attribute_values)]
+    instances_by_class = defaultdict(list)
+    for instance in source_instances:
+        instances_by_class[instance[class_index]].append(instance)
+    class_labels = sorted(instances_by_class, key=lambda label: -len(instances_by_class[label]))
+    if class_skew is None:
+        class_weights = [len(instances_by_class[label]) for label in class_labels]
+    else:
+        class_weights = [class_skew] + [(1 - class_skew) / (len(class_labels) - 1)] * (len(class_labels) - 1)
+    instances = []
+    for class_label in rng.choices(class_labels, class_weights, k=num_instances):
+        source_instance = rng.choice(instances_by_class[class_label])
+        instance = [class_label]
+        for i, values, value_map in zip(attribute_indexes, attribute_values, value_maps):
+            if noise and rng.random() < noise:
+                instance.append(rng.choice(values))
+            else:
+                instance.append(value_map[source_instance[i]])
+        instances.append(instance)
+    return instances
+
+
+def measure(function, repeat=1):
+    '''Returns the result of calling function, the minimum number of seconds taken by repeat calls,
+    and the peak memory (in bytes) allocated by Python during one more call.
+
+    Memory is measured in a separate call, since tracing allocations slows down the code being timed.'''
+    seconds = None
+    for _ in range(repeat):
+        start_time = default_timer()
+        result = function()
+        elapsed = default_timer() - start_time
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    tracemalloc.start()
+    try:
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak_memory
+
+
+def run_benchmarks(instances, repeat=1, n_jobs=1, num_partitions=5):
+    '''Returns a dictionary mapping the name of each benchmark to its seconds, throughput and peak memory'''
+    results = {}
+
+    def record(name, function, num_items):
+        result, seconds, peak_memory = measure(function, repeat)
+        results[name] = {'seconds': seconds,
+                         'items_per_second': num_items / seconds if seconds else None,
+                         'peak_memory_bytes': peak_memory}
+        return result
+
+    handle, filename = tempfile.mkstemp(suffix='.data')
+    os.close(handle)
+    try:
+        simple_ml.save_instances(filename, instances)
+        num_instances = len(instances)
+        record('load', lambda: simple_ml.load_instances(filename), num_instances)
+        encoded_instances = record('load_encoded',
+                                   lambda: simple_ml.load_instances(filename, attribute_names_and_values=[]),
+                                   num_instances)
+        simple_ml.load_cached_instances(filename)  # create the cache, so that only cache hits are timed
+        record('load_cached', lambda: simple_ml.load_cached_instances(filename), num_instances)
+    finally:
+        for name in (filename, filename + '.encoded'):
+            if os.path.exists(name):
+                os.remove(name)
+    record('encode', lambda: simple_ml.encode_instances(instances), num_instances)
+    tree = record('fit', lambda: simple_ml.create_decision_tree(instances), num_instances)
+    record('fit_encoded', lambda: simple_ml.create_decision_tree(encoded_instances), num_instances)
+    record('fit_bitsets', lambda: simple_ml.create_decision_tree(encoded_instances, use_bitsets=True), num_instances)
+    if n_jobs != 1:
+        record('fit_parallel', lambda: simple_ml.create_decision_tree(encoded_instances, n_jobs=n_jobs),
+               num_instances)
+    decision_tree = SimpleDecisionTree()
+    decision_tree.fit(encoded_instances)
+    record('predict', lambda: [simple_ml.classify(tree, instance) for instance in instances], num_instances)
+    record('predict_simple_decision_tree', lambda: decision_tree.predict(instances), num_instances)
+    compiled_tree = record('compile', decision_tree.compile, 1)
+    # classifying one instance at a time with the compiled tree is the baseline for predict_batch
+    record('predict_compiled', lambda: [compiled_tree.classify(instance) for instance in instances], num_instances)
+    record('predict_batch', lambda: decision_tree.predict_batch(instances), num_instances)
+    record('predict_batch_encoded', lambda: decision_tree.predict_batch(encoded_instances), num_instances)
+    record('learning_curve',
+           lambda: simple_ml.compute_learning_curve(encoded_instances, num_partitions, n_jobs=n_jobs),
+           num_partitions - 1)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''Returns a list of (name, baseline seconds, seconds, ratio) tuples for the benchmarks in results
+    that took more than 1 + tolerance times as long as in baseline'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name in baseline and baseline[name]['seconds']:
+            ratio = result['seconds'] / baseline[name]['seconds']
+            if ratio > 1 + tolerance:
+                regressions.append((name, baseline[name]['seconds'], result['seconds'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark simple_ml on synthetic data shaped like agaricus-lepiota')
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       'agaricus-lepiota.data'),
+                        help='the source instances to replicate and perturb')
+    parser.add_argument('--num-instances', type=int, default=50000)
+    parser.add_argument('--num-attributes', type=int, default=None)
+    parser.add_argument('--max-values', type=int, default=None, help='maximum number of values per attribute')
+    parser.add_argument('--class-skew', type=float, default=None,
+                        help='proportion of instances with the most common class label')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='probability of replacing each attribute value with a random value')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='number of timings per benchmark (the minimum is kept)')
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--output', help='file to save the results in (JSON); by default they are printed')
+    parser.add_argument('--baseline', help='file of previous results (JSON) to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown relative to the baseline that is reported as a regression')
+    args = parser.parse_args(argv)
+
+    parameters = dict((name, value) for name, value in vars(args).items()
+                      if name not in ('output', 'baseline', 'tolerance'))
+    instances = generate_instances(simple_ml.load_instances(args.data), args.num_instances, args.num_attributes,
+                                   args.max_values, args.class_skew, args.noise, seed=args.seed)
+    report = {'parameters': parameters,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'results': run_benchmarks(instances, args.repeat, args.n_jobs)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != parameters:
+            print('Warning: the baseline was run with different parameters', file=sys.stderr)
+        regressions = compare(report['results'], baseline['results'], args.tolerance)
+        for name, baseline_seconds, seconds, ratio in regressions:
+            print('{}: {:.4f}s (baseline {:.4f}s, {:.2f}x)'.format(name, seconds, baseline_seconds, ratio),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
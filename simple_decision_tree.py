@@ -7,27 +7,55 @@ __author__ = 'Joe McCarthy'
 __email__ = 'joe@interrelativity.com'
 
 
+from array import array
 from collections import Counter
 from pprint import pprint
-from simple_ml import majority_value, choose_best_attribute_index, split_instances
+from simple_ml import EncodedInstances, encode_instances, create_decision_tree, compile_tree, classify
+from simple_ml import save_compiled_tree, load_compiled_tree, tree_to_json
+from simple_ml import AttributeStatistics, best_information_gain_and_index, majority_value, is_single_instance
 
 
 class SimpleDecisionTree:
 
 
     _tree = {}  # this instance variable becomes accessible to class methods via self._tree
+    _vocabularies = None  # the value vocabularies of the encoded instances used to fit the tree
+    _compiled_tree = None  # the flattened version of _tree used by predict_batch()
+    _fit_arguments = None  # the instances (if incremental), candidate, target, default class and weights of the last call to fit()
+    _history = None  # the (encoded) instances added by partial_fit()
+    _root = None  # the _IncrementalNode statistics of the root of a tree built by partial_fit()
+    _default_class = None  # the default class of the last call to fit() or partial_fit(), or of a loaded tree
 
 
-    def __init__(self):
-        # this is where we would initialize any parameters to the SimpleDecisionTree
-        pass
+    def __init__(self, n_jobs=1, min_parallel_instances=10000, 
+                 max_depth=None, min_samples_split=2, min_gain=0.0, max_leaf_nodes=None, max_seconds=None,
+                 missing_value=None, use_bitsets=False, incremental=False):
+        # n_jobs is the number of processes used to fit the tree (see simple_ml.create_decision_tree)
+        self.n_jobs = n_jobs
+        self.min_parallel_instances = min_parallel_instances
+        # the limits on the growth of the tree (see simple_ml.create_decision_tree); 
+        # partial_fit() only applies max_depth, min_samples_split and min_gain
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_gain = min_gain
+        self.max_leaf_nodes = max_leaf_nodes
+        self.max_seconds = max_seconds
+        # the attribute value (e.g., '?') that marks a missing value, if missing values should be 
+        # handled as in C4.5 rather than as ordinary values (see simple_ml.create_decision_tree)
+        self.missing_value = missing_value
+        # whether the instances of each node are represented by bitsets (see simple_ml.InstanceBitsets)
+        self.use_bitsets = use_bitsets
+        # whether fit() keeps its (encoded) instances, so that partial_fit() can add to them later
+        self.incremental = incremental
             
     def fit(self, 
             instances, 
             candidate_attribute_indexes=None,
             target_attribute_index=0,
             default_class=None,
-            trace=0):
+            trace=0,
+            report=None,
+            weights=None):
         '''
         Build a decision tree that best fits the data in instances.
         
@@ -39,6 +67,9 @@ class SimpleDecisionTree:
         The class label is found in target_attribute_index.
         The default_class is the majority value for that branch of the tree.
         A positive trace value will print trace information during tree construction.
+        If a simple_ml.BuildReport is provided as report, it collects counters and timers during tree construction.
+        If weights (a sequence of the weights of instances, in order) is provided, each instance counts as 
+        its weight, e.g., the counts of the distinct instances returned by simple_ml.deduplicate_instances.
     
         Derived from the simplified ID3 algorithm presented in 
         Building Decision Trees in Python by Christopher Roach,
@@ -48,10 +79,21 @@ class SimpleDecisionTree:
             candidate_attribute_indexes = [i 
                                            for i in range(len(instances[0]))
                                            if i != target_attribute_index]
+        # encode the instances once, so that each node of the tree is a view of a slice of a shared index array
+        instances = encode_instances(instances)
+        self._vocabularies = instances.vocabularies
+        self._compiled_tree = None
+        self._fit_arguments = (instances if self.incremental else None,
+                               candidate_attribute_indexes, target_attribute_index, default_class, weights)
+        self._default_class = default_class
+        self._history = self._root = None
         self._tree = self._create_tree(instances,
                                        candidate_attribute_indexes,
                                        target_attribute_index,
-                                       default_class)
+                                       default_class,
+                                       trace,
+                                       report,
+                                       weights)
 
 
     def _create_tree(self,
@@ -59,79 +101,172 @@ class SimpleDecisionTree:
                      candidate_attribute_indexes,
                      target_attribute_index=0,
                      default_class=None,
-                     trace=0):
-        class_labels_and_counts = Counter([instance[target_attribute_index] 
-                                           for instance in instances])
-        # If the dataset is empty or the candidate attributes list is empty, 
-        # return the default class label
-        if not instances or not candidate_attribute_indexes:
-            if trace:
-                print('{}Using default class {}'.format('< ' * trace, default_class))
-            return default_class
-            
-        # If all the instances have the same class label, return that class label
-        elif len(class_labels_and_counts) == 1:
-            class_label = class_labels_and_counts.most_common(1)[0][0]
-            if trace:
-                print('{}All {} instances have label {}'.format(
-                    '< ' * trace, len(instances), class_label))
-            return class_label
-
-		# Otherwise, create a new subtree and add it to the tree
+                     trace=0,
+                     report=None,
+                     weights=None):
+        # the recursive ID3 algorithm is shared with simple_ml.create_decision_tree, 
+        # which can also build the subtrees in parallel
+        return create_decision_tree(instances,
+                                    candidate_attribute_indexes,
+                                    target_attribute_index,
+                                    default_class,
+                                    trace,
+                                    self.n_jobs,
+                                    self.min_parallel_instances,
+                                    report=report,
+                                    max_depth=self.max_depth,
+                                    min_samples_split=self.min_samples_split,
+                                    min_gain=self.min_gain,
+                                    max_leaf_nodes=self.max_leaf_nodes,
+                                    max_seconds=self.max_seconds,
+                                    missing_value=self.missing_value,
+                                    weights=weights,
+                                    use_bitsets=self.use_bitsets)
+
+
+    def partial_fit(self,
+                    instances,
+                    candidate_attribute_indexes=None,
+                    target_attribute_index=0,
+                    default_class=None):
+        '''
+        Update the decision tree to fit the additional data in instances.
+        
+        In the style of the ID4 and ITI algorithms, each node of the tree keeps the class counts 
+        of each value of each attribute for the instances that reach it (an AttributeStatistics object),
+        and each leaf keeps the positions of its instances in the history of the instances added so far.
+        New instances only update the statistics of the nodes they reach, and a subtree is rebuilt 
+        (from the instances at its leaves) only when its best attribute changes, so the cost of an update
+        depends on the number of new instances rather than the size of the history.
+        The resulting tree is the one that fit() would build from all of the instances.
+        
+        The candidate_attribute_indexes, target_attribute_index and default_class of the first call
+        (or of the last call to fit(), whose instances are included) are used by later calls.
+        fit() only keeps its instances if the tree was constructed with incremental=True, 
+        so partial_fit() cannot update a tree fit without it.
+        Missing values and weights cannot be handled incrementally, so missing_value must be None 
+        (and fit() must not have been given weights).
+        '''
+        if self.missing_value is not None:
+            raise ValueError('partial_fit() cannot be used with missing_value')
+        if self._root is None:
+            if self._fit_arguments is not None:
+                fit_instances, candidate_attribute_indexes, target_attribute_index, default_class, fit_weights = \
+                    self._fit_arguments
+                if fit_weights is not None:
+                    raise ValueError('partial_fit() cannot update a tree fit with weights')
+                if fit_instances is None:
+                    raise ValueError('partial_fit() cannot update a tree fit without incremental=True')
+            else:
+                fit_instances = None
+                if not candidate_attribute_indexes:
+                    candidate_attribute_indexes = [i 
+                                                   for i in range(len(instances[0]))
+                                                   if i != target_attribute_index]
+            self._candidate_attribute_indexes = list(candidate_attribute_indexes)
+            self._target_attribute_index = target_attribute_index
+            self._default_class = default_class
+            # the history starts with a copy of the codes of the instances given to fit(), rather than decoding them
+            self._history = fit_instances.copy() if fit_instances is not None else EncodedInstances([], [])
+            self._history.extend(instances)
+            self._root = self._grow(self._history.indexed(), self._candidate_attribute_indexes, default_class, 0)
         else:
-            default_class = majority_value(instances, target_attribute_index)
-
-            # Choose the next best attribute index to best classify the instances
-            best_index = choose_best_attribute_index(instances,
-                                                     candidate_attribute_indexes, 
-                                                     target_attribute_index)
-            if trace:
-                print('{}Creating tree node for attribute index {}'.format(
-                	'> ' * trace, best_index))
-
-            # Create a new decision tree node with the best attribute index 
-            # and an empty dictionary object (for now)
-            tree = {best_index:{}}
-
-            # Create a new decision tree sub-node (branch) 
-            # for each of the values in the best attribute field       
-            partitions = split_instances(instances, best_index)
-            
-            # Remove that attribute from the set of candidates for further splits
-            remaining_candidate_attribute_indexes = [i 
-                                                     for i in candidate_attribute_indexes 
-                                                     if i != best_index]
-                                                     
-            for attribute_value in partitions:
-                if trace:
-                    print('{}Creating subtree for value {} ({}, {}, {}, {})'.format(
-                        '> ' * trace,
-                        attribute_value, 
-                        len(partitions[attribute_value]), 
-                        len(remaining_candidate_attribute_indexes), 
-                        target_attribute_index, 
-                        default_class))
-
-	            # Create a subtree for each value of the the best attribute
-                subtree = self._create_tree(
-                    partitions[attribute_value],
-                    remaining_candidate_attribute_indexes,
-                    target_attribute_index,
-                    default_class)
-
-                # Add the new subtree to the empty dictionary object 
-                # in the new tree/node created above
-                tree[best_index][attribute_value] = subtree
+            start = len(self._history)
+            self._history.extend(instances)
+            self._root = self._update(self._root, 
+                                      self._history.view(range(start, len(self._history))),
+                                      self._default_class)
+        self._tree = self._root.tree()
+        self._vocabularies = self._history.vocabularies
+        self._compiled_tree = None
 
-            return tree
+
+    def _grow(self, instances, candidate_attribute_indexes, default_class, depth):
+        # a new subtree for instances (a view of the history)
+        node = _IncrementalNode(candidate_attribute_indexes, default_class, self._target_attribute_index, depth)
+        node.statistics.update(instances)
+        return self._split(node, instances)
+
+
+    def _best_attribute_index(self, node):
+        # the attribute index that node should split on, or None if it should be a leaf
+        if node.is_leaf() or \
+                (self.max_depth is not None and node.depth >= self.max_depth) or \
+                len(node.statistics) < self.min_samples_split:
+            return None
+        best_gain, best_index = best_information_gain_and_index(node.statistics,
+                                                                node.candidate_attribute_indexes,
+                                                                self._target_attribute_index)
+        if self.min_gain and best_gain < self.min_gain:
+            return None
+        return best_index
+
+
+    def _split(self, node, instances):
+        # make node a leaf, or split its instances (whose statistics it already has) among new subtrees
+        node.attribute_index = None
+        node.children = {}
+        best_index = self._best_attribute_index(node)
+        if best_index is None:
+            node.positions = array(instances.index.typecode, instances.rows())
+            return node
+        node.positions = None
+        node.attribute_index = best_index
+        remaining_candidate_attribute_indexes = [i 
+                                                 for i in node.candidate_attribute_indexes 
+                                                 if i != node.attribute_index]
+        majority = majority_value(node.statistics, self._target_attribute_index)
+        for attribute_value, partition in instances.partition(node.attribute_index).items():
+            node.children[attribute_value] = self._grow(partition, remaining_candidate_attribute_indexes, majority,
+                                                        node.depth + 1)
+        return node
+
+
+    def _update(self, node, instances, default_class):
+        # add the counts of instances (a view of new instances in the history) to the subtree at node
+        old_majority = majority_value(node.statistics, self._target_attribute_index) if len(node.statistics) else None
+        node.default_class = default_class
+        if len(instances):
+            node.statistics.update(instances)
+        if node.attribute_index is None:
+            node.positions.extend(instances.rows())
+            if self._best_attribute_index(node) is None:
+                return node
+            return self._split(node, self._history.view(node.positions))
+        best_index = self._best_attribute_index(node)
+        if best_index != node.attribute_index:
+            # rebuild the subtree from the (old and new) instances at its leaves, reusing the statistics of node;
+            # they are kept in the order they were added, so that ties between majority values are broken as in fit()
+            positions = node.leaf_positions()
+            positions.extend(instances.rows())
+            positions = array(positions.typecode, sorted(positions))
+            return self._split(node, self._history.view(positions))
+        majority = majority_value(node.statistics, self._target_attribute_index)
+        partitions = instances.partition(node.attribute_index) if len(instances) else {}
+        for attribute_value, child in node.children.items():
+            # a child without new instances only needs to be updated if its default class has changed
+            if attribute_value in partitions or majority != old_majority:
+                node.children[attribute_value] = self._update(
+                    child, partitions.get(attribute_value, self._history.view([])), majority)
+        remaining_candidate_attribute_indexes = [i 
+                                                 for i in node.candidate_attribute_indexes 
+                                                 if i != node.attribute_index]
+        for attribute_value, partition in partitions.items():
+            if attribute_value not in node.children:
+                node.children[attribute_value] = self._grow(partition, remaining_candidate_attribute_indexes, majority,
+                                                            node.depth + 1)
+        return node
 
 
     def predict(self, instances, default_class=None):
-    	'''Return the predicted class label(s) of instance(s)'''
-        if not isinstance(instances, list):
-            return self._predict(self._tree, instance, default_class)
+        '''Return the predicted class label(s) of instance(s)'''
+        if default_class is None:
+            default_class = self._default_class
+        tree = self._nested_tree()
+        if is_single_instance(instances):
+            return self._predict(tree, instances, default_class)
         else:
-            return [self._predict(self._tree, instance, default_class) 
+            return [self._predict(tree, instance, default_class) 
                     for instance in instances]
 
         
@@ -141,22 +276,74 @@ class SimpleDecisionTree:
             return default_class
         if not isinstance(tree, dict):
             return tree
-        attribute_index = list(tree.keys())[0]  # using list(dict.keys()) for Py3 compatibiity
-        attribute_values = list(tree.values())[0]
+        attribute_index, attribute_values = next(iter(tree.items()))  # the only item, without copying keys or values
         instance_attribute_value = instance[attribute_index]
         if instance_attribute_value not in attribute_values:
+            if self.missing_value is not None and instance_attribute_value == self.missing_value:
+                # the instance follows every branch (see simple_ml.classify)
+                return classify(tree, instance, default_class, self.missing_value)
             return default_class
         return self._predict(attribute_values[instance_attribute_value],
                              instance,
                              default_class)
 
 
+    def compile(self):
+        '''Flatten the tree into the parallel arrays of a CompiledTree, for use by predict_batch()'''
+        self._compiled_tree = compile_tree(self._nested_tree(), self._vocabularies, self.missing_value)
+        return self._compiled_tree
+
+
+    def predict_batch(self, instances, default_class=None):
+        '''Return the predicted class labels of a list of instances (or EncodedInstances), 
+        splitting them among the children of each node of the compiled tree all at once'''
+        if default_class is None:
+            default_class = self._default_class
+        if self._compiled_tree is None:
+            self.compile()
+        return self._compiled_tree.predict_batch(instances, default_class)
+
+
+    def save(self, filename):
+        '''Save the compiled tree, its vocabularies and the default class to a binary file (see load)'''
+        if self._compiled_tree is None:
+            self.compile()
+        save_compiled_tree(filename, self._compiled_tree, self._default_class)
+
+
+    @classmethod
+    def load(cls, filename):
+        '''Return a new SimpleDecisionTree with the tree saved in a file by save.
+        
+        The file is memory-mapped, so a tree loads quickly, whatever its size, and processes that load 
+        the same file share one copy of it. The nested dictionary representation of the tree 
+        (used by predict() and pprint()) is only rebuilt from the compiled tree when it is first needed.'''
+        decision_tree = cls()
+        decision_tree._compiled_tree, decision_tree._default_class = load_compiled_tree(filename)
+        decision_tree.missing_value = decision_tree._compiled_tree.missing_value
+        decision_tree._vocabularies = decision_tree._compiled_tree.vocabularies
+        decision_tree._tree = None
+        return decision_tree
+
+
+    def _nested_tree(self):
+        # the nested dictionary representation of the tree, rebuilt from the compiled tree of a loaded tree
+        if self._tree is None:
+            self._tree = self._compiled_tree.tree()
+        return self._tree
+
+
+    def to_json(self, attribute_names=None):
+        '''Return a JSON representation of the tree, for inspection (see simple_ml.tree_to_json)'''
+        return tree_to_json(self._nested_tree(), attribute_names)
+
+
     def classification_accuracy(self, instances, default_class=None):
-    	'''Return a tuple with 
-    	the number of correctly classified instances,
-    	the number of incorrectly classified instances,
-    	the proportion of instances that were correctly classified
-    	'''
+        '''Return a tuple with 
+        the number of correctly classified instances,
+        the number of incorrectly classified instances,
+        the proportion of instances that were correctly classified
+        '''
         predicted_labels = self.predict(instances, default_class)
         actual_labels = [x[0] for x in instances]
         counts = Counter([x == y for x, y in zip(predicted_labels, actual_labels)])
@@ -164,4 +351,42 @@ class SimpleDecisionTree:
         
         
     def pprint(self):
-        pprint(self._tree)
\ No newline at end of file
+        pprint(self._nested_tree())
+
+
+class _IncrementalNode(object):
+    '''The sufficient statistics of a node of a tree built by SimpleDecisionTree.partial_fit()'''
+    
+    def __init__(self, candidate_attribute_indexes, default_class, target_attribute_index, depth=0):
+        self.candidate_attribute_indexes = candidate_attribute_indexes
+        self.default_class = default_class
+        self.target_attribute_index = target_attribute_index
+        self.depth = depth  # the depth of the node in the tree (the root is at depth 0)
+        self.statistics = AttributeStatistics(class_index=target_attribute_index)
+        self.attribute_index = None  # the attribute the node splits on, or None for a leaf
+        self.children = {}  # attribute value -> _IncrementalNode
+        self.positions = None  # for a leaf, an array of the positions of its instances in the history
+    
+    def is_leaf(self):
+        '''Returns whether ID3 would make this node a leaf'''
+        return (not len(self.statistics) 
+                or not self.candidate_attribute_indexes
+                or len(self.statistics.value_counts[self.target_attribute_index]) == 1)
+    
+    def leaf_positions(self):
+        '''Returns an array of the positions of the instances at all of the leaves of this subtree'''
+        if self.attribute_index is None:
+            return self.positions
+        child_positions = [child.leaf_positions() for child in self.children.values()]
+        positions = array(child_positions[0].typecode)
+        for positions_of_child in child_positions:
+            positions.extend(positions_of_child)
+        return positions
+    
+    def tree(self):
+        '''Returns this subtree in the nested dictionary representation used by create_decision_tree'''
+        if self.attribute_index is not None:
+            return {self.attribute_index: dict((value, child.tree()) for value, child in self.children.items())}
+        if not len(self.statistics) or not self.candidate_attribute_indexes:
+            return self.default_class
+        return self.statistics.majority_value()
@@ -4,24 +4,46 @@ from __future__ import print_function, division
 '''
 
 __author__ = 'Joe McCarthy'
-__version__ = '1.0.3'
-__date__ = '2014-04-04'
+__version__ = '1.1.0'
+__date__ = '2026-10-17'
 __maintainer__ = 'Joe McCarthy'
 __email__ = 'joe@interrelativity.com'
 __status__ = 'Development'
 
 
+import hashlib
+import heapq
+import json
 import math
+import mmap
 import operator
+import os
+import random
+import struct
+import sys
 
-from collections import defaultdict, Counter
+from array import array
+from itertools import count, repeat
+from timeit import default_timer
+from collections import defaultdict, deque, Counter
+from functools import lru_cache
 
 
-def load_instances(filename, filter_missing_values=False, missing_value='?'):
+def load_instances(filename, filter_missing_values=False, missing_value='?', attribute_names_and_values=None):
     '''Returns a list of instances stored in a file.
     
     filename is expected to have a series of comma-separated attribute values per line, e.g.,
-        p,k,f,n,f,n,f,c,n,w,e,?,k,y,w,n,p,w,o,e,w,v,d'''
+        p,k,f,n,f,n,f,c,n,w,e,?,k,y,w,n,p,w,o,e,w,v,d
+    
+    If attribute_names_and_values (as returned by load_attribute_names_and_values) is provided,
+    the instances are returned as a compact EncodedInstances object rather than a list of lists.'''
+    if attribute_names_and_values is not None:
+        # encode one batch at a time, so that the whole file is never held as lists of strings
+        encoded_instances = EncodedInstances.from_attribute_names_and_values(attribute_names_and_values)
+        for batch in load_instance_batches(filename, filter_missing_values=filter_missing_values, 
+                                           missing_value=missing_value):
+            encoded_instances.extend(batch)
+        return encoded_instances
     instances = []
     with open(filename, 'r') as f:
         for line in f:
@@ -31,14 +53,272 @@ def load_instances(filename, filter_missing_values=False, missing_value='?'):
     return instances
 
 
-def save_instances(filename, instances):
+def load_instance_batches(filename, batch_size=10000, filter_missing_values=False, missing_value='?', 
+                          attribute_names_and_values=None):
+    '''Generates batches of the instances stored in a file, reading only one batch into memory at a time.
+    
+    Each batch is a list of batch_size instances (except, perhaps, the last one), 
+    filtered as they are read in the same way as load_instances.
+    If attribute_names_and_values is provided, each batch is an EncodedInstances object instead;
+    all of the batches share the same vocabularies, so a value has the same code in every batch.
+    
+    For example, the attribute value counts of a file that is too large to load can be computed by
+        counts = Counter()
+        for batch in load_instance_batches(filename):
+            counts.update(attribute_value_counts(batch, attribute, attribute_names))'''
+    if attribute_names_and_values is not None:
+        encoded_instances = EncodedInstances.from_attribute_names_and_values(attribute_names_and_values)
+    batch = []
+    with open(filename, 'r') as f:
+        for line in f:
+            new_instance = line.strip().split(',')
+            if not filter_missing_values or missing_value not in new_instance:
+                batch.append(new_instance)
+                if len(batch) == batch_size:
+                    if attribute_names_and_values is not None:
+                        yield encoded_instances.encode(batch)
+                    else:
+                        yield batch
+                    batch = []
+    if batch:
+        if attribute_names_and_values is not None:
+            yield encoded_instances.encode(batch)
+        else:
+            yield batch
+
+
+def load_deduplicated_instances(filename, filter_missing_values=False, missing_value='?', 
+                                attribute_names_and_values=None, batch_size=10000):
+    '''Returns a tuple of the distinct instances stored in a file (in order of their first occurrence) 
+    and a list of the number of occurrences of each of them, which can be used as their weights 
+    (e.g., by create_decision_tree).
+    
+    The file is read one batch at a time (see load_instance_batches), so only the distinct instances 
+    are ever held in memory. The instances are filtered and (if attribute_names_and_values is provided) 
+    encoded as by load_instances.'''
+    if attribute_names_and_values is not None:
+        instances = EncodedInstances.from_attribute_names_and_values(attribute_names_and_values)
+    else:
+        instances = []
+    positions = {}  # instance (as a tuple) -> position in instances
+    weights = []
+    for batch in load_instance_batches(filename, batch_size, filter_missing_values, missing_value):
+        new_instances = []
+        for instance in batch:
+            key = tuple(instance)
+            position = positions.get(key)
+            if position is None:
+                positions[key] = len(weights)
+                weights.append(1)
+                new_instances.append(instance)
+            else:
+                weights[position] += 1
+        instances.extend(new_instances)
+    return instances, weights
+
+
+def deduplicate_instances(instances, weights=None):
+    '''Returns a tuple of the distinct instances in instances (in order of their first occurrence)
+    and a list of the number of occurrences of each of them (or, if weights is provided, 
+    the sum of their weights), which can be used as their weights (e.g., by create_decision_tree).
+    
+    The distinct instances of EncodedInstances are a view of them, rather than a copy.'''
+    if isinstance(instances, EncodedInstances):
+        rows = zip(*[instances.column_codes(i) for i in range(len(instances.columns))])
+    else:
+        rows = map(tuple, instances)
+    positions = {}  # row -> position in unique_positions
+    unique_positions = []
+    unique_weights = []
+    for position, row, weight in zip(count(), rows, repeat(1) if weights is None else weights):
+        unique_position = positions.get(row)
+        if unique_position is None:
+            positions[row] = len(unique_positions)
+            unique_positions.append(position)
+            unique_weights.append(weight)
+        else:
+            unique_weights[unique_position] += weight
+    if isinstance(instances, EncodedInstances):
+        return instances.view(unique_positions), unique_weights
+    return [instances[position] for position in unique_positions], unique_weights
+
+
+def save_instances(filename, instances, mode='w'):
     '''Saves a list of instances to a file.
     
     instances are saved to filename one per line, 
-    where each instance is a list of attribute value strings.'''
-    with open(filename, 'w') as f:
-        for instance in instances:
-            f.write(','.join(instance) + '\n')
+    where each instance is a list of attribute value strings.
+    A mode of 'a' appends the instances to filename rather than replacing its contents.'''
+    save_instance_batches(filename, [instances], mode)
+
+
+def save_instance_batches(filename, batches, mode='w', buffer_size=1 << 20):
+    '''Saves a sequence of batches of instances (lists or EncodedInstances) to a file, in the format of save_instances.
+    
+    Each batch is formatted as a single string, which is written in one call to a file 
+    with a write buffer of buffer_size bytes, so batches can be generated (e.g., by load_instance_batches)
+    and saved without holding more than one of them in memory.'''
+    with open(filename, mode, buffer_size) as f:
+        for batch in batches:
+            f.write(''.join([','.join(instance) + '\n' for instance in batch]))
+
+
+_ENCODED_INSTANCES_MAGIC = b'SIMPLEML-ENCODED-1\n'
+
+
+def _save_arrays(filename, magic, header, arrays):
+    '''Saves arrays to a binary file that can be memory-mapped by _load_arrays.
+    
+    The file contains magic, the length (8 bytes, little-endian) of a JSON header (header, 
+    with the byte order, type codes, lengths and offsets of the arrays added to it), 
+    and then the raw bytes of each array, aligned on 8 byte boundaries.
+    The file is written to a temporary file that then replaces filename, so processes that have 
+    mapped an older version of filename are not disturbed.'''
+    header = dict(header,
+                  byteorder=sys.byteorder,
+                  typecodes=[_typecode(values) for values in arrays],
+                  lengths=[len(values) for values in arrays])
+    offsets = []
+    offset = 0
+    for values in arrays:
+        offsets.append(offset)
+        offset += (len(values) * values.itemsize + 7) // 8 * 8
+    header['offsets'] = offsets
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = (len(magic) + 8 + len(header_bytes) + 7) // 8 * 8
+    temporary_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temporary_filename, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for values, values_offset in zip(arrays, offsets):
+            f.seek(data_offset + values_offset)
+            f.write(values.tobytes())
+        f.truncate(data_offset + offset)
+    os.replace(temporary_filename, filename)
+
+
+def _load_arrays(filename, magic, description):
+    '''Returns the header and the arrays saved in a file by _save_arrays.
+    
+    The file is memory-mapped read-only, and the arrays are (read-only) memoryviews of the mapping, 
+    unless they were saved on a machine with a different byte order, in which case they are converted copies.
+    A ValueError mentioning description is raised if the file does not start with magic.'''
+    with open(filename, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(magic)] != magic:
+        raise ValueError('{} is not {}'.format(filename, description))
+    header_start = len(magic) + 8
+    header_length = struct.unpack('<Q', mapping[len(magic):header_start])[0]
+    header = json.loads(mapping[header_start:header_start + header_length].decode('utf-8'))
+    data_offset = (header_start + header_length + 7) // 8 * 8
+    arrays = []
+    for typecode, length, offset in zip(header['typecodes'], header['lengths'], header['offsets']):
+        start = data_offset + offset
+        values = memoryview(mapping)[start:start + length * array(typecode).itemsize].cast(typecode)
+        if header['byteorder'] != sys.byteorder and values.itemsize > 1:
+            values = array(typecode, values.tobytes())  # a copy, in this machine's byte order
+            values.byteswap()
+        arrays.append(values)
+    return header, arrays
+
+
+def save_encoded_instances(filename, instances, source=None):
+    '''Saves EncodedInstances to a binary file that can be memory-mapped by load_encoded_instances.
+    
+    The file contains a magic string, the length (8 bytes, little-endian) of a JSON header
+    with the vocabularies, the type codes and offsets of the columns and the optional source description
+    (see load_cached_instances), and then the raw bytes of each column, aligned on 8 byte boundaries.
+    The file is written to a temporary file that then replaces filename, so processes that have 
+    mapped an older version of filename are not disturbed.'''
+    columns = [instances.column_codes(i) for i in range(len(instances.columns))]
+    header = {'num_instances': len(instances),
+              'vocabularies': instances.vocabularies,
+              'source': source}
+    _save_arrays(filename, _ENCODED_INSTANCES_MAGIC, header, columns)
+
+
+def load_encoded_instances(filename):
+    '''Returns the EncodedInstances saved in a file by save_encoded_instances, and the source description.
+    
+    The file is memory-mapped read-only, and the columns are memoryviews of the mapping, so loading
+    takes time proportional to the size of the header rather than the number of instances,
+    and processes that load the same file share the pages of its columns. 
+    (The columns are read-only, so appending instances to the EncodedInstances raises a ValueError;
+    instances can be appended to a copy() of them.)'''
+    header, columns = _load_arrays(filename, _ENCODED_INSTANCES_MAGIC, 'a file of encoded instances')
+    return EncodedInstances(columns, header['vocabularies']), header['source']
+
+
+def load_cached_instances(filename, attribute_filename=None, cache_filename=None, 
+                          filter_missing_values=False, missing_value='?'):
+    '''Returns the instances stored in a file as EncodedInstances, using a binary cache of them if possible.
+    
+    The cache (by default, filename with the suffix '.encoded') is written by save_encoded_instances 
+    the first time filename is loaded, and memory-mapped by load_encoded_instances thereafter.
+    The cache records the size, modification time and SHA-1 hash of filename (and attribute_filename),
+    as well as the filtering options. It is rebuilt if any of those options differ, or if the size 
+    or hash of a source file has changed; the hash is only recomputed if a file's time has changed, 
+    and if the hash is unchanged, the new time is recorded in the cache.
+    
+    The vocabularies of the instances are initialized from attribute_filename, if provided 
+    (see load_attribute_names_and_values).'''
+    if cache_filename is None:
+        cache_filename = filename + '.encoded'
+    source_filenames = [filename] + ([attribute_filename] if attribute_filename else [])
+    options = {'filter_missing_values': filter_missing_values, 'missing_value': missing_value}
+    if os.path.exists(cache_filename):
+        try:
+            instances, source = load_encoded_instances(cache_filename)
+        except (ValueError, KeyError):
+            source = None  # an unreadable cache is simply rebuilt
+        if source:
+            mtimes = [description['mtime'] for description in source['files']]
+        if (source and source['options'] == options 
+                and [description['filename'] for description in source['files']] == source_filenames
+                and all(_source_unchanged(description) for description in source['files'])):
+            if [description['mtime'] for description in source['files']] != mtimes:
+                # a source file was touched but not changed: record its new time, so it is not hashed again
+                save_encoded_instances(cache_filename, instances, source)
+            return instances
+    attribute_names_and_values = (load_attribute_names_and_values(attribute_filename) if attribute_filename 
+                                  else [])
+    instances = load_instances(filename, filter_missing_values, missing_value, attribute_names_and_values)
+    source = {'options': options, 'files': [_describe_source(name) for name in source_filenames]}
+    save_encoded_instances(cache_filename, instances, source)
+    return load_encoded_instances(cache_filename)[0]
+
+
+def _describe_source(filename):
+    '''Returns a description of a file (its name, size, modification time and hash) for load_cached_instances'''
+    status = os.stat(filename)
+    return {'filename': filename, 'size': status.st_size, 'mtime': status.st_mtime, 'sha1': _file_hash(filename)}
+
+
+def _source_unchanged(description):
+    '''Returns whether the file described by _describe_source(description['filename']) is unchanged.
+    
+    If only the modification time of the file has changed, description is updated with the new time.'''
+    try:
+        status = os.stat(description['filename'])
+    except OSError:
+        return False
+    if status.st_size != description['size']:
+        return False
+    if status.st_mtime == description['mtime']:
+        return True
+    if _file_hash(description['filename']) != description['sha1']:
+        return False
+    description['mtime'] = status.st_mtime
+    return True
+
+
+def _file_hash(filename, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
 
 
 def load_attribute_names(filename, separator=':'):
@@ -89,7 +369,7 @@ def load_attribute_values(attribute_filename):
 
 
 def load_attribute_names_and_values(filename):
-    '''Returns a list of attribute names and values in filename.
+    '''Returns a list of attribute names and values in filename (an AttributeSchema).
     
     This list contains dictionaries wherein the keys are names 
     and the values are value description dictionaries.
@@ -125,9 +405,339 @@ def load_attribute_names_and_values(filename):
                         value_abbreviation_description_dict[abbreviation] = description
                 attribute_name_and_value_dict['values'] = value_abbreviation_description_dict
             attribute_names_and_values.append(attribute_name_and_value_dict)
-    return attribute_names_and_values
+    return AttributeSchema(attribute_names_and_values)
+
+
+class AttributeSchema(list):
+    '''The names and values of the attributes of a dataset, as returned by load_attribute_names_and_values.
+    
+    An AttributeSchema is a list of {'name': name, 'values': value description dictionary} dictionaries
+    (see load_attribute_names_and_values), with lookup tables that are computed once:
+        names[i] is the name of attribute i, and indexes[name] is the index of the attribute named name
+        descriptions[i] maps each value abbreviation of attribute i to its description,
+            and abbreviations[i] maps each description back to its abbreviation
+        vocabularies[i] is the list of the value abbreviations of attribute i, and value_codes[i] maps
+            each abbreviation to its position (code) in vocabularies[i], as in EncodedInstances
+    
+    An AttributeSchema can be used in place of a list of attribute names by attribute_value, 
+    print_attribute_names_and_values, attribute_value_counts, print_all_attribute_value_counts, 
+    AttributeStatistics and tree_to_json, which then find an attribute by name in constant time.
+    (The tables are not updated if the list is modified.)'''
+    
+    def __init__(self, attribute_names_and_values=()):
+        list.__init__(self, attribute_names_and_values)
+        self.names = [attribute['name'] for attribute in self]
+        self.indexes = dict((name, i) for i, name in enumerate(self.names))
+        self.descriptions = [dict(attribute['values'] or {}) for attribute in self]
+        self.abbreviations = [dict((description, abbreviation) for abbreviation, description in descriptions.items())
+                              for descriptions in self.descriptions]
+        self.vocabularies = [[value for value in descriptions if value is not None] 
+                             for descriptions in self.descriptions]
+        self.value_codes = [dict((value, code) for code, value in enumerate(vocabulary)) 
+                            for vocabulary in self.vocabularies]
+    
+    def attribute_index(self, attribute):
+        '''Returns the index of attribute, which may be a name or an index;
+        raises a ValueError if there is no attribute with that name'''
+        if isinstance(attribute, int):
+            return attribute
+        index = self.indexes.get(attribute)
+        if index is None:
+            raise ValueError('{} is not an attribute name'.format(attribute))
+        return index
+    
+    def description(self, attribute, abbreviation):
+        '''Returns the description of the value of attribute (a name or an index) abbreviated as abbreviation'''
+        return self.descriptions[self.attribute_index(attribute)].get(abbreviation)
+    
+    def abbreviation(self, attribute, description):
+        '''Returns the abbreviation of the value of attribute (a name or an index) described as description'''
+        return self.abbreviations[self.attribute_index(attribute)].get(description)
+
+
+def _attribute_names(attribute_names):
+    '''Returns the list of names in attribute_names (a list of names or an AttributeSchema)'''
+    return attribute_names.names if isinstance(attribute_names, AttributeSchema) else attribute_names
+
+
+def _attribute_index(attribute, attribute_names):
+    '''Returns the position of attribute in attribute_names (a list of names or an AttributeSchema),
+    or raises a ValueError if it is not there'''
+    if isinstance(attribute_names, AttributeSchema):
+        return attribute_names.attribute_index(attribute)
+    return attribute_names.index(attribute)
+    
+    
+class EncodedInstances(object):
+    '''A compact, column-oriented representation of a list of instances.
+    
+    Each attribute is dictionary-encoded: vocabularies[i] is a list of the values of attribute i,
+    and columns[i] is an array('B') holding, for each instance, the position (code) of its value
+    in vocabularies[i]. An instance therefore costs one byte per attribute rather than 
+    a Python list of strings. (A column whose attribute has more than 256 values is widened to array('H').)
+    
+    An EncodedInstances object may also be a view of the instances at positions index[start:end] 
+    of another object's columns, where index is an array of instance positions shared by all of the views
+    (see indexed() and partition()). Views copy no attribute values.
+    
+    Indexing or iterating over an EncodedInstances object yields decoded lists of attribute value strings,
+    so it can be used wherever a list of instances is expected; the functions in this module
+    recognize it and count the encoded columns directly rather than walking the rows.'''
+    
+    max_values = 256  # the number of distinct codes that fit into an unsigned byte
+    
+    def __init__(self, columns, vocabularies):
+        self.columns = columns
+        self.vocabularies = vocabularies
+        self.value_codes = [dict((value, code) for code, value in enumerate(vocabulary))
+                            for vocabulary in vocabularies]
+        self.index = None
+        self.start = 0
+        self.end = None
+        self.rows_getter = None
+    
+    @classmethod
+    def from_attribute_names_and_values(cls, attribute_names_and_values):
+        '''Returns an empty EncodedInstances object whose vocabularies are initialized with the 
+        value abbreviations in attribute_names_and_values (as returned by load_attribute_names_and_values)'''
+        if isinstance(attribute_names_and_values, AttributeSchema):
+            # copies, since the vocabularies grow as new values are encoded
+            vocabularies = [list(vocabulary) for vocabulary in attribute_names_and_values.vocabularies]
+        else:
+            vocabularies = [[value for value in (attribute['values'] or {}) if value is not None]
+                            for attribute in attribute_names_and_values]
+        return cls([array('B') for _ in vocabularies], vocabularies)
+    
+    def __len__(self):
+        if self.index is not None:
+            return self.end - self.start
+        return len(self.columns[0]) if self.columns else 0
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.subset(range(len(self))[i])
+        if self.index is not None:
+            if not -len(self) <= i < len(self):
+                raise IndexError('instance index out of range')
+            i = self.index[self.start + i if i >= 0 else self.end + i]
+        return [vocabulary[column[i]] for column, vocabulary in zip(self.columns, self.vocabularies)]
+    
+    def __iter__(self):
+        # decode a column at a time, rather than a row at a time
+        decoded_columns = [map(vocabulary.__getitem__, self.column_codes(i)) 
+                           for i, vocabulary in enumerate(self.vocabularies)]
+        for instance in zip(*decoded_columns):
+            yield list(instance)
+    
+    def rows(self):
+        '''Returns an iterable of the positions of this object's instances in its columns'''
+        if self.index is None:
+            return range(len(self))
+        return self.index[self.start:self.end]  # a slice costs its length, wherever it starts in the index
+    
+    def column_codes(self, attribute_index):
+        '''Returns the codes of attribute_index for this object's instances, in order.
+        
+        This is the column itself unless this object is a view, in which case the codes are gathered.'''
+        column = self.columns[attribute_index]
+        if self.index is None:
+            return column
+        if self.rows_getter is None:  # shared by all of the columns, as creating it costs about as much as a gather
+            # (it holds a Python int per instance, so the tree builders release it once a node's counts are made)
+            self.rows_getter = _items_getter(self.index[self.start:self.end])
+        return array(_typecode(column), self.rows_getter(column))
+    
+    def encode_value(self, attribute_index, value):
+        '''Returns the code of value for attribute_index, adding value to the vocabulary if it is new'''
+        value_codes = self.value_codes[attribute_index]
+        code = value_codes.get(value)
+        if code is None:
+            vocabulary = self.vocabularies[attribute_index]
+            if len(vocabulary) >= self.max_values ** 2:
+                raise ValueError('attribute {} has more than {} distinct values'.format(
+                    attribute_index, self.max_values ** 2))
+            if len(vocabulary) >= self.max_values and self.columns[attribute_index].typecode == 'B':
+                self.columns[attribute_index] = array('H', self.columns[attribute_index])
+            code = value_codes[value] = len(vocabulary)
+            vocabulary.append(value)
+        return code
+    
+    def append(self, instance):
+        '''Encodes instance (a list of attribute value strings) and adds it to the columns'''
+        self._check_appendable()
+        if not self.columns:  # no vocabularies yet: infer the number of attributes from the first instance
+            self.columns = [array('B') for _ in instance]
+            self.vocabularies = [[] for _ in instance]
+            self.value_codes = [{} for _ in instance]
+        self._check_length(instance)
+        for i, value in enumerate(instance):
+            self.columns[i].append(self.encode_value(i, value))
+    
+    def extend(self, instances):
+        '''Encodes a list of instances and adds them to the columns, one column at a time'''
+        self._check_appendable()
+        instances = list(instances)
+        if instances and not self.columns:
+            self.append(instances[0])
+            instances = instances[1:]
+        for instance in instances:
+            self._check_length(instance)
+        for i in range(len(self.columns)):
+            values = list(map(operator.itemgetter(i), instances))
+            value_codes = self.value_codes[i]
+            for value in dict.fromkeys(values):  # new values are given codes in order of appearance
+                if value not in value_codes:
+                    self.encode_value(i, value)
+            self.columns[i].extend(map(self.value_codes[i].__getitem__, values))
+    
+    def encode(self, instances=()):
+        '''Returns a new EncodedInstances object containing instances (a list of lists of attribute values),
+        encoded with (and adding any new values to) this object's vocabularies'''
+        encoded_instances = self._view(None, 0, None)
+        encoded_instances.columns = [array('B' if len(vocabulary) <= self.max_values else 'H') 
+                                     for vocabulary in self.vocabularies]
+        encoded_instances.extend(instances)
+        return encoded_instances
+    
+    def _check_appendable(self):
+        if self.index is not None:
+            raise ValueError('cannot append an instance to a view')
+        if not all(isinstance(column, array) for column in self.columns):
+            raise ValueError('cannot append an instance to read-only (e.g., memory-mapped) columns; '
+                             'append to a copy() instead')
+    
+    def _check_length(self, instance):
+        if len(instance) != len(self.columns):
+            raise ValueError('expected {} attribute values, found {}: {}'.format(
+                len(self.columns), len(instance), instance))
+    
+    def _view(self, index, start, end):
+        view = EncodedInstances.__new__(EncodedInstances)
+        view.columns = self.columns
+        view.vocabularies = self.vocabularies
+        view.value_codes = self.value_codes
+        view.index = index
+        view.start = start
+        view.end = end
+        view.rows_getter = None
+        return view
+    
+    def subset(self, indexes):
+        '''Returns a new EncodedInstances object containing copies of the instances at indexes, 
+        sharing this object's vocabularies'''
+        rows = list(self.rows())
+        rows = [rows[i] for i in indexes]
+        subset = self._view(None, 0, None)
+        subset.columns = [array(_typecode(column), bytearray(map(column.__getitem__, rows)) 
+                                if _typecode(column) == 'B' else map(column.__getitem__, rows)) 
+                          for column in self.columns]
+        return subset
     
+    def copy(self):
+        '''Returns a new EncodedInstances object containing copies of the codes and vocabularies 
+        of this object's instances, to which instances can be added without changing this object'''
+        columns = [self.column_codes(i) for i in range(len(self.columns))]
+        if self.index is None:  # otherwise, the gathered codes are already copies
+            columns = [array(_typecode(column), column) for column in columns]
+        return EncodedInstances(columns, [list(vocabulary) for vocabulary in self.vocabularies])
     
+    def indexed(self):
+        '''Returns a view of this object's instances over a new index array, which can then be partitioned'''
+        return self._view(_index_array(self.rows()), 0, len(self))
+    
+    def view(self, positions):
+        '''Returns a view of the instances at positions (in this object) over a new index array, 
+        without copying them'''
+        if self.index is not None:
+            positions = map(self.index.__getitem__, (self.start + position for position in positions))
+        index = _index_array(positions)
+        return self._view(index, 0, len(index))
+    
+    def partition(self, attribute_index):
+        '''Returns a dictionary mapping each value of attribute_index to a view of the instances with that value.
+        
+        The view's index[start:end] is reordered in place by a (stable) counting sort on the codes of 
+        attribute_index, so that the instances having each value occupy a contiguous slice of it;
+        the views returned share the index array and copy no attribute values.'''
+        if self.index is None:
+            return self.indexed().partition(attribute_index)
+        column = self.columns[attribute_index]
+        vocabulary = self.vocabularies[attribute_index]
+        self.rows_getter = None
+        # a single C-level pass appends each position to the array of positions of its code
+        rows = self.rows()
+        positions_by_code = defaultdict(lambda: _index_array(()))
+        deque(map(array.append, map(positions_by_code.__getitem__, map(column.__getitem__, rows)), rows), 0)
+        rows = None
+        partitions = {}
+        start = self.start
+        for code in sorted(positions_by_code):
+            positions = positions_by_code.pop(code)
+            self.index[start:start + len(positions)] = positions
+            partitions[vocabulary[code]] = self._view(self.index, start, start + len(positions))
+            start += len(positions)
+        return partitions
+
+
+def _typecode(codes):
+    '''Returns the type code of an array, or the format of a memoryview (e.g., of shared memory)'''
+    return codes.typecode if isinstance(codes, array) else codes.format
+
+
+def _index_array(positions):
+    '''Returns an array of (unsigned, at least 32-bit) instance positions'''
+    return array('I' if array('I').itemsize >= 4 else 'L', positions)
+
+
+def _items_getter(positions):
+    '''Returns a function that gathers the items at positions of a sequence into a tuple'''
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda sequence: (sequence[position],)
+    return operator.itemgetter(*positions) if positions else lambda sequence: ()
+
+
+def encode_instances(instances, attribute_names_and_values=None):
+    '''Returns an EncodedInstances object containing the same instances as the list instances.
+    
+    If attribute_names_and_values is provided, its value abbreviations determine the codes of the values; 
+    values that are not listed there are assigned new codes in order of appearance.'''
+    if isinstance(instances, EncodedInstances):
+        return instances
+    if attribute_names_and_values is not None:
+        encoded_instances = EncodedInstances.from_attribute_names_and_values(attribute_names_and_values)
+    else:
+        encoded_instances = EncodedInstances([], [])
+    encoded_instances.extend(instances)
+    return encoded_instances
+
+
+def _value_counts(instances, attribute_index, weights=None):
+    '''Returns a Counter containing the counts of occurrences of each value of attribute_index in instances
+    (or, if weights is provided, the sums of the weights of the instances with each value)'''
+    if isinstance(instances, (AttributeStatistics, InstanceBitsets)) and weights is not None:
+        raise ValueError('weights cannot be applied to {}'.format(instances.__class__.__name__))
+    if isinstance(instances, AttributeStatistics):
+        return Counter(instances.value_counts[attribute_index])
+    if isinstance(instances, InstanceBitsets):
+        return instances.value_counts(attribute_index)
+    if weights is not None:
+        if isinstance(instances, EncodedInstances):
+            values = map(instances.vocabularies[attribute_index].__getitem__, 
+                         instances.column_codes(attribute_index))
+        else:
+            values = map(operator.itemgetter(attribute_index), instances)
+        value_weights = Counter()
+        for value, weight in zip(values, weights):
+            value_weights[value] += weight
+        return value_weights
+    if isinstance(instances, EncodedInstances):
+        vocabulary = instances.vocabularies[attribute_index]
+        return Counter(dict((vocabulary[code], count) 
+                            for code, count in Counter(instances.column_codes(attribute_index)).items()))
+    return Counter([instance[attribute_index] for instance in instances])
+
+
 def attribute_values(instances, attribute_index):
     '''Returns the distinct values of an attribute across a list of instances.
     
@@ -135,113 +745,494 @@ def attribute_values(instances, attribute_index):
     attribute_index is expected bo be a the position of attribute in instances.
     
     See http://www.peterbe.com/plog/uniqifiers-benchmark for variants on this algorirthm'''
+    if isinstance(instances, AttributeStatistics):
+        return list(instances.value_counts[attribute_index])
+    if isinstance(instances, EncodedInstances):
+        vocabulary = instances.vocabularies[attribute_index]
+        return [vocabulary[code] for code in set(instances.column_codes(attribute_index))]
     return list(set([x[attribute_index] for x in instances]))
 
 
 def attribute_value(instance, attribute, attribute_names):
     '''Returns the value of an attribute in an instance.
     
-    Based on the position of attribute in the list of attribute_names'''
-    if attribute not in attribute_names:
+    Based on the position of attribute in the list of attribute_names (or the AttributeSchema attribute_names)'''
+    try:
+        i = _attribute_index(attribute, attribute_names)
+    except ValueError:
         return None
-    else:
-        i = attribute_names.index(attribute)
-        return instance[i] # using the parameter name here
+    return instance[i] # using the parameter name here
         
 
 def print_attribute_names_and_values(instance, attribute_names):
     '''Prints the attribute names and values for instance'''
+    attribute_names = _attribute_names(attribute_names)
     print('Values for the', len(attribute_names), 'attributes:', end='\n\n')
-    for i in range(len(attribute_names)):
-        print(attribute_names[i], '=', 
-        	  attribute_value(instance, attribute_names[i], attribute_names))
+    for i, attribute_name in enumerate(attribute_names):  # the position of each name is already known
+        print(attribute_name, '=', instance[i])
 
 
 def attribute_value_counts(instances, attribute, attribute_names):
     '''Returns a Counter containing the counts of occurrences
      of each value of attribute in the list of instances.
-    attribute_names is a list of names of attributes.'''
-    i = attribute_names.index(attribute)
-    return Counter([instance[i] for instance in instances])
+    attribute_names is a list of names of attributes (or an AttributeSchema).'''
+    i = _attribute_index(attribute, attribute_names)
+    return _value_counts(instances, i)
 
 
 def print_all_attribute_value_counts(instances, attribute_names):
     '''Returns a list of Counters containing the counts of occurrences 
     of each value of each attribute in the list of instances.
-    attribute_names is a list of names of attributes.'''
-    num_instances = len(instances)
-    for attribute in attribute_names:
-        value_counts = attribute_value_counts(instances, attribute, attribute_names)
+    attribute_names is a list of names of attributes (or an AttributeSchema).
+    
+    All of the counts are computed at once by an AttributeStatistics object (unless instances is one already).'''
+    statistics = instances if isinstance(instances, AttributeStatistics) else AttributeStatistics(instances)
+    num_instances = len(statistics)
+    for i, attribute in enumerate(_attribute_names(attribute_names)):
+        value_counts = statistics.value_counts[i]
         print('{}:'.format(attribute), end=' ')
         for value, count in sorted(value_counts.items(), key=operator.itemgetter(1), reverse=True):
             print('{} = {} ({:5.3f}),'.format(value, count, count / num_instances), end=' ')
         print()
-        
+
+
+class AttributeStatistics(object):
+    '''The counts of the values of every attribute in a collection of instances, 
+    together with the class-conditional counts (contingency tables) of every attribute.
     
-def entropy(instances, class_index=0, attribute_name=None, value_name=None):
-    '''Calculate the entropy of attribute in position attribute_index for the list of instances.'''
-    num_instances = len(instances)
-    if num_instances <= 1:
+    The counts are computed together, with a single counting pass over each attribute of the instances 
+    (see contingency_tables), and update() can add the counts of further instances, 
+    e.g., of each batch generated by load_instance_batches, so instances need not fit in memory.
+    
+    value_counts[i] is a Counter of the values of attribute i, 
+    and tables[i] is the contingency table of attribute i and the class attribute (class_index).
+    
+    An AttributeStatistics object can be used in place of the instances it summarizes by 
+    attribute_values, attribute_value_counts, print_all_attribute_value_counts, entropy, information_gain, 
+    majority_value and choose_best_attribute_index, which then answer from its counts.'''
+    
+    def __init__(self, instances=(), class_index=0, attribute_names=None):
+        self.class_index = class_index
+        self.num_instances = 0
+        self.value_counts = []
+        self.tables = []
+        self.attribute_indexes = {}  # attribute name -> attribute index
+        if isinstance(attribute_names, AttributeSchema):
+            self.attribute_indexes = attribute_names.indexes
+        elif attribute_names:
+            self.attribute_indexes = dict((name, i) for i, name in enumerate(attribute_names))
+        self.update(instances)
+    
+    @classmethod
+    def from_batches(cls, batches, class_index=0, attribute_names=None):
+        '''Returns the AttributeStatistics of all of the instances in a sequence of batches'''
+        statistics = cls(class_index=class_index, attribute_names=attribute_names)
+        for batch in batches:
+            statistics.update(batch)
+        return statistics
+    
+    def __len__(self):
+        return self.num_instances
+    
+    def update(self, instances):
+        '''Adds the counts of instances (a list of instances or EncodedInstances)'''
+        if not len(instances):
+            return
+        num_attributes = len(instances[0])
+        while len(self.tables) < num_attributes:
+            self.value_counts.append(Counter())
+            self.tables.append(defaultdict(Counter))
+        tables = contingency_tables(instances, range(num_attributes), self.class_index)
+        for i in range(num_attributes):
+            for value, class_counts in tables[i].items():
+                self.tables[i][value].update(class_counts)
+                self.value_counts[i][value] += sum(class_counts.values())
+        self.num_instances += len(instances)
+    
+    def attribute_index(self, attribute):
+        '''Returns the index of attribute, which may be a name (in attribute_names) or an index'''
+        return self.attribute_indexes.get(attribute, attribute)
+    
+    def attribute_values(self, attribute):
+        return list(self.value_counts[self.attribute_index(attribute)])
+    
+    def attribute_value_counts(self, attribute):
+        return Counter(self.value_counts[self.attribute_index(attribute)])
+    
+    def class_counts(self):
+        return Counter(self.value_counts[self.class_index])
+    
+    def entropy(self, attribute=None):
+        '''Returns the entropy of the values of attribute (by default, the class attribute)'''
+        if attribute is None:
+            attribute = self.class_index
+        return counts_entropy(self.value_counts[self.attribute_index(attribute)].values())
+    
+    def information_gain(self, attribute):
+        '''Returns the information gain of splitting the instances on attribute'''
+        return contingency_table_information_gain(self.tables[self.attribute_index(attribute)])
+    
+    def majority_value(self, attribute=None):
+        '''Returns the most frequent value of attribute (by default, the class attribute)'''
+        if attribute is None:
+            attribute = self.class_index
+        return self.value_counts[self.attribute_index(attribute)].most_common(1)[0][0]
+
+
+try:
+    _popcount = int.bit_count  # the number of 1 bits of an int (Python 3.10 or later)
+except AttributeError:
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+
+class InstanceBitsets(object):
+    '''The instances of EncodedInstances as bitsets: for each attribute i and each code c of its values,
+    bitsets[i][c] is an int whose bit n is set if instance n has the value with code c.
+    
+    An InstanceBitsets object represents the set of instances whose bits are set in rows; partition()
+    returns an InstanceBitsets object for the instances having each value of an attribute, whose rows 
+    are just the AND of rows and the bitset of the value (the bitsets themselves are shared).
+    The number of instances with each (value, class) pair is the number of 1 bits (popcount) 
+    of the AND of rows and the bitsets of the value and the class, so counting them takes 
+    a few big int operations (over all of the instances, 64 at a time) rather than a scan of the instances;
+    this is fastest for attributes with few values, such as those of the mushroom dataset.
+    
+    An InstanceBitsets object can be used in place of the instances it represents by 
+    entropy, information_gain, majority_value, choose_best_attribute_index, split_instances and 
+    create_decision_tree (see its use_bitsets option).'''
+    
+    def __init__(self, instances, class_index=0):
+        instances = encode_instances(instances)
+        self.class_index = class_index
+        self.vocabularies = instances.vocabularies
+        self.bitsets = [_column_bitsets(instances.column_codes(i), len(vocabulary), len(instances)) 
+                        for i, vocabulary in enumerate(instances.vocabularies)]
+        self.rows = (1 << len(instances)) - 1
+        self.num_instances = len(instances)
+    
+    def __len__(self):
+        return self.num_instances
+    
+    def _view(self, rows, num_instances):
+        view = object.__new__(self.__class__)
+        view.__dict__.update(self.__dict__)
+        view.rows = rows
+        view.num_instances = num_instances
+        return view
+    
+    def value_counts(self, attribute_index):
+        '''Returns a Counter of the values of attribute_index, in order of their first occurrence'''
+        counts = []
+        for code, bits in enumerate(self.bitsets[attribute_index]):
+            bits &= self.rows
+            if bits:
+                counts.append(((bits & -bits).bit_length(), self.vocabularies[attribute_index][code], 
+                               _popcount(bits)))
+        return Counter(dict((value, num_instances) for _, value, num_instances in sorted(counts)))
+    
+    def contingency_table(self, attribute_index):
+        '''Returns the contingency table of attribute_index and the class attribute (see contingency_tables)'''
+        class_vocabulary = self.vocabularies[self.class_index]
+        class_bitsets = [(class_vocabulary[code], bits & self.rows) 
+                         for code, bits in enumerate(self.bitsets[self.class_index])]
+        class_bitsets = [(class_label, bits) for class_label, bits in class_bitsets if bits]
+        table = defaultdict(Counter)
+        for code, bits in enumerate(self.bitsets[attribute_index]):
+            bits &= self.rows
+            if not bits:
+                continue
+            class_counts = table[self.vocabularies[attribute_index][code]]
+            num_remaining = _popcount(bits)
+            for class_label, class_bits in class_bitsets[:-1]:
+                num_instances = _popcount(bits & class_bits)
+                if num_instances:
+                    class_counts[class_label] = num_instances
+                    num_remaining -= num_instances
+            if num_remaining:  # the instances of the last class are the ones that remain
+                class_counts[class_bitsets[-1][0]] = num_remaining
+        return table
+    
+    def partition(self, attribute_index):
+        '''Returns a dictionary mapping each value of attribute_index to an InstanceBitsets object 
+        representing the instances with that value'''
+        partitions = {}
+        for code, bits in enumerate(self.bitsets[attribute_index]):
+            bits &= self.rows
+            if bits:
+                partitions[self.vocabularies[attribute_index][code]] = self._view(bits, _popcount(bits))
+        return partitions
+
+
+# for each one byte code, a table that translates the code to b'1' and any other byte to b'0'
+_BIT_TABLES = [bytes(bytearray(ord('1') if byte == code else ord('0') for byte in range(256))) 
+               for code in range(256)]
+
+
+def _column_bitsets(column, num_codes, num_instances):
+    '''Returns a list of the bitsets of the instances having each code in column'''
+    if _typecode(column) == 'B':
+        # translate the codes to a string of binary digits (the last instance first) once per code, in C
+        codes = column.tobytes()[::-1]
+        return [int(codes.translate(_BIT_TABLES[code]) or b'0', 2) for code in range(num_codes)]
+    bitsets = [bytearray((num_instances + 7) // 8) for _ in range(num_codes)]
+    for position, code in enumerate(column):
+        bitsets[code][position >> 3] |= 1 << (position & 7)
+    return [int.from_bytes(bits, 'little') for bits in bitsets]
+
+
+def entropy(instances, class_index=0, attribute_name=None, value_name=None, weights=None):
+    '''Calculate the entropy of attribute in position attribute_index for the list of instances.
+    
+    If weights (a sequence of the weights of instances, in order) is provided, 
+    each instance counts as its weight.'''
+    num_instances = len(instances) if weights is None else math.fsum(weights)
+    if weights is None and num_instances <= 1:
         return 0
-    value_counts = defaultdict(int)
-    for instance in instances:
-        value_counts[instance[class_index]] += 1
+    value_counts = _value_counts(instances, class_index, weights)
     num_values = len(value_counts)
     if num_values <= 1:
         return 0
+    if not attribute_name:
+        return counts_entropy(value_counts.values())
     attribute_entropy = 0.0
-    if attribute_name:
-        print('entropy({}{}) = '.format(attribute_name, 
-        	'={}'.format(value_name) if value_name else ''))
+    print('entropy({}{}) = '.format(attribute_name, 
+    	'={}'.format(value_name) if value_name else ''))
     for value in value_counts:
         value_probability = value_counts[value] / num_instances
         child_entropy = value_probability * math.log(value_probability, 2)
         attribute_entropy -= child_entropy
-        if attribute_name:
-            print('  - p({0}) x log(p({0}), {1})  =  - {2:5.3f} x log({2:5.3f})  =  {3:5.3f}'.format(
-                value, num_values, value_probability, child_entropy))
-    if attribute_name:
-        print('  = {:5.3f}'.format(attribute_entropy))
+        print('  - p({0}) x log(p({0}), {1})  =  - {2:5.3f} x log({2:5.3f})  =  {3:5.3f}'.format(
+            value, num_values, value_probability, child_entropy))
+    print('  = {:5.3f}'.format(attribute_entropy))
     return attribute_entropy
 
 
-def information_gain(instances, parent_index, class_index=0, attribute_name=False):
-    '''Return the information gain of splitting the instances based on the attribute parent_index'''
-    parent_entropy = entropy(instances, class_index, attribute_name)
+def information_gain(instances, parent_index, class_index=0, attribute_name=False, weights=None):
+    '''Return the information gain of splitting the instances based on the attribute parent_index
+    (with each instance counting as its weight, if weights is provided)'''
+    if not attribute_name:
+        # no trace is required, so the gain can be computed from counts without building child instance lists
+        return contingency_table_information_gain(
+            contingency_tables(instances, [parent_index], class_index, weights)[parent_index])
+    parent_entropy = entropy(instances, class_index, attribute_name, weights=weights)
     child_instances = defaultdict(list)
-    for instance in instances:
+    child_weights = defaultdict(list)
+    for instance, weight in zip(instances, repeat(1) if weights is None else weights):
         child_instances[instance[parent_index]].append(instance)
+        child_weights[instance[parent_index]].append(weight)
     children_entropy = 0.0
-    num_instances = len(instances)
+    num_instances = len(instances) if weights is None else math.fsum(weights)
     for child_value in child_instances:
-        child_probability = len(child_instances[child_value]) / num_instances
+        if weights is None:
+            child_probability = len(child_instances[child_value]) / num_instances
+        else:
+            child_probability = math.fsum(child_weights[child_value]) / num_instances
         children_entropy += child_probability * entropy(
-        	child_instances[child_value], class_index, attribute_name, child_value)
+        	child_instances[child_value], class_index, attribute_name, child_value, 
+        	child_weights[child_value] if weights is not None else None)
     return parent_entropy - children_entropy
+
+
+def contingency_tables(instances, attribute_indexes, class_index=0, weights=None):
+    '''Returns a dictionary mapping each of attribute_indexes to its contingency table in instances.
     
+    A contingency table is a dictionary whose keys are the values of the attribute
+    and whose values are Counters of the class labels (in position class_index) of the instances 
+    having that value, for example
+        {'a': Counter({'e': 400}), 'l': Counter({'e': 400}), 'c': Counter({'p': 192}), ...}
+    All of the tables are computed by counting (value, class label) pairs in a single call,
+    without partitioning the instances.
+    
+    If weights (a sequence of the weights of instances, in order) is provided, 
+    the tables contain the sums of the weights of the instances rather than their counts.'''
+    if weights is not None:
+        if isinstance(instances, (AttributeStatistics, InstanceBitsets)):
+            raise ValueError('weights cannot be applied to {}'.format(instances.__class__.__name__))
+        return _weighted_contingency_tables(instances, attribute_indexes, class_index, weights)
+    if isinstance(instances, (AttributeStatistics, InstanceBitsets)):
+        if class_index != instances.class_index:
+            raise ValueError('the statistics were computed for class index {}, not {}'.format(
+                instances.class_index, class_index))
+        if isinstance(instances, InstanceBitsets):
+            return dict((i, instances.contingency_table(i)) for i in attribute_indexes)
+        return dict((i, instances.tables[i]) for i in attribute_indexes)
+    tables = {}
+    class_column = instances.column_codes(class_index) if isinstance(instances, EncodedInstances) else None
+    for attribute_index in attribute_indexes:
+        table = defaultdict(Counter)
+        for (value, class_label), count in _value_pair_counts(
+                instances, attribute_index, class_index, class_column).items():
+            table[value][class_label] = count
+        tables[attribute_index] = table
+    return tables
+
 
-def majority_value(instances, class_index=0):
-    '''Return the most frequent value of class_index in instances'''
-    class_counts = Counter([instance[class_index] for instance in instances])
+def _value_pair_counts(instances, attribute_index, class_index, class_column=None):
+    '''Returns a Counter containing the counts of occurrences 
+    of each (attribute_index value, class_index value) pair in instances.
+    
+    class_column optionally provides the (previously gathered) class codes of EncodedInstances.'''
+    if not isinstance(instances, EncodedInstances):
+        return Counter(map(operator.itemgetter(attribute_index, class_index), instances))
+    column = instances.column_codes(attribute_index)
+    if class_column is None:
+        class_column = instances.column_codes(class_index)
+    vocabulary = instances.vocabularies[attribute_index]
+    class_vocabulary = instances.vocabularies[class_index]
+    num_classes = len(class_vocabulary)
+    if _typecode(column) == 'B' and len(vocabulary) * num_classes <= EncodedInstances.max_values:
+        # pack each pair of codes into a single code, value * num_classes + class, 
+        # so that counting them (like numpy.bincount) hashes small ints rather than tuples
+        scale = bytes(bytearray(code * num_classes % EncodedInstances.max_values 
+                                for code in range(EncodedInstances.max_values)))
+        code_counts = Counter(map(operator.add, bytearray(column.tobytes().translate(scale)), class_column))
+        code_pairs = [divmod(code, num_classes) for code in code_counts]
+    else:
+        code_counts = Counter(zip(column, class_column))
+        code_pairs = list(code_counts)
+    return Counter(dict(((vocabulary[value_code], class_vocabulary[class_code]), count)
+                        for (value_code, class_code), count in zip(code_pairs, code_counts.values())))
+
+
+def _weighted_contingency_tables(instances, attribute_indexes, class_index, weights):
+    '''Returns the contingency tables of contingency_tables, with the weights of instances summed'''
+    if isinstance(instances, EncodedInstances):
+        class_column = instances.column_codes(class_index)
+        class_vocabulary = instances.vocabularies[class_index]
+    else:
+        class_column = [instance[class_index] for instance in instances]
+        class_vocabulary = None
+    tables = {}
+    for attribute_index in attribute_indexes:
+        pair_weights = defaultdict(float)
+        if isinstance(instances, EncodedInstances):
+            column = instances.column_codes(attribute_index)
+        else:
+            column = [instance[attribute_index] for instance in instances]
+        for pair, weight in zip(zip(column, class_column), weights):
+            pair_weights[pair] += weight
+        table = defaultdict(Counter)
+        if class_vocabulary is not None:
+            vocabulary = instances.vocabularies[attribute_index]
+            for (value_code, class_code), weight in pair_weights.items():
+                table[vocabulary[value_code]][class_vocabulary[class_code]] = weight
+        else:
+            for (value, class_label), weight in pair_weights.items():
+                table[value][class_label] = weight
+        tables[attribute_index] = table
+    return tables
+
+
+def contingency_table_information_gain(table, missing_value=None):
+    '''Returns the information gain of the split described by a contingency table (see contingency_tables).
+    
+    The terms are summed with math.fsum, so the gain does not depend on the order in which 
+    values were first counted; attributes whose gains are mathematically equal tie exactly.
+    
+    If missing_value is provided, the instances with that value (whose value is unknown) are handled as in C4.5:
+    the gain is that of the split of the instances whose value is known, multiplied by 
+    the proportion of instances whose value is known.'''
+    if missing_value is not None and missing_value in table:
+        known_table = dict((value, value_class_counts) for value, value_class_counts in table.items() 
+                           if value != missing_value)
+        num_known = math.fsum(count for value_class_counts in known_table.values() 
+                              for count in value_class_counts.values())
+        num_instances = num_known + math.fsum(table[missing_value].values())
+        if num_known == 0:
+            return 0.0
+        return num_known / num_instances * contingency_table_information_gain(known_table)
+    class_counts = Counter()
+    for value_class_counts in table.values():
+        class_counts.update(value_class_counts)
+    num_instances = sum(class_counts.values())
+    if num_instances == 0:
+        return 0.0
+    children_entropy = math.fsum(sum(value_class_counts.values()) / num_instances 
+                                 * counts_entropy(value_class_counts.values())
+                                 for value_class_counts in table.values())
+    return counts_entropy(class_counts.values()) - children_entropy
+
+
+# count * log2(count) for small counts, so that most entropy terms are a table lookup
+_COUNT_LOG_COUNT = [0.0] + [count * math.log(count, 2) for count in range(1, 4096)]
+
+
+def counts_entropy(counts):
+    '''Returns the entropy of a distribution, given the counts of each of its values (e.g., a Counter's values()).
+    
+    The entropy only depends on the multiset of counts, so it is memoized (see _sorted_counts_entropy)
+    with the sorted tuple of counts as the key.'''
+    return _sorted_counts_entropy(tuple(sorted(count for count in counts if count)))
+
+
+@lru_cache(maxsize=1 << 16)
+def _sorted_counts_entropy(counts):
+    '''Returns the entropy of a tuple of non-zero counts (or weights), computed as 
+        (n log2(n) - sum(c log2(c))) / n
+    where n is the sum of the counts c, rather than as - sum(p log2(p)) for p = c / n.
+    The terms are summed with math.fsum, so distributions with the same counts have exactly the same entropy.'''
+    if len(counts) <= 1:
+        return 0.0
+    num_instances = math.fsum(counts)
+    count_log_count = [_COUNT_LOG_COUNT[count] if count < len(_COUNT_LOG_COUNT) and count.__class__ is int 
+                       else count * math.log(count, 2)
+                       for count in counts]
+    return (num_instances * math.log(num_instances, 2) - math.fsum(count_log_count)) / num_instances
+    
+
+def majority_value(instances, class_index=0, weights=None):
+    '''Return the most frequent value of class_index in instances 
+    (the value with the greatest total weight, if weights is provided)'''
+    class_counts = _value_counts(instances, class_index, weights)
     return class_counts.most_common(1)[0][0]
 
 
 def choose_best_attribute_index(instances, candidate_attribute_indexes, class_index=0):
     '''Return the index of the attribute that will provide the greatest information gain 
-    if instances were partitioned based on that attribute'''
-    gains_and_indexes = sorted([(information_gain(instances, i), i) for i in candidate_attribute_indexes], 
+    if instances were partitioned based on that attribute.
+    
+    The gains of all of the candidate_attribute_indexes are derived from a single batch of
+    contingency tables, rather than by partitioning instances once per candidate.'''
+    return best_information_gain_and_index(instances, candidate_attribute_indexes, class_index)[1]
+
+
+def _split_candidate_attribute_indexes(candidate_attribute_indexes, max_features, random_generator):
+    '''Returns the candidate attribute indexes to choose the best attribute of a node from:
+    all of them, or a random sample of max_features of them (drawn with random_generator)'''
+    if max_features is None or max_features >= len(candidate_attribute_indexes):
+        return candidate_attribute_indexes
+    return (random_generator or random).sample(candidate_attribute_indexes, max_features)
+
+
+def best_information_gain_and_index(instances, candidate_attribute_indexes, class_index=0, 
+                                    weights=None, missing_value=None):
+    '''Return a tuple of the greatest information gain of the candidate_attribute_indexes
+    and the index of the attribute with that gain (as chosen by choose_best_attribute_index).
+    
+    The optional weights of instances and missing_value are used as in contingency_tables 
+    and contingency_table_information_gain.'''
+    tables = contingency_tables(instances, candidate_attribute_indexes, class_index, weights)
+    gains_and_indexes = sorted([(contingency_table_information_gain(tables[i], missing_value), i) 
+                                for i in candidate_attribute_indexes], 
                                reverse=True)
-    return gains_and_indexes[0][1]
+    return gains_and_indexes[0]
+
+
+def partition_sort_key(partition, class_index=0):
+    '''Returns a key for sorting partitions (lists of instances) by their entropy, then their size, 
+    as cmp_partitions does, e.g., sorted(partitions, key=partition_sort_key).
+    
+    Sorting with a key computes the entropy of each partition once, 
+    rather than up to four times per comparison.'''
+    return entropy(partition, class_index), len(partition)
 
 
 def cmp_partitions(p1, p2):
-    if entropy(p1) < entropy(p2):
-        return -1
-    elif entropy(p1) > entropy(p2):
-        return 1
-    elif len(p1) < len(p2):
+    key1, key2 = partition_sort_key(p1), partition_sort_key(p2)
+    if key1 < key2:
         return -1
-    elif len(p1) > len(p2):
+    elif key1 > key2:
         return 1
     return 0
 
@@ -251,6 +1242,15 @@ def split_instances(instances, attribute_index):
     
     The key of each dictionary is a distinct value of attribute_index,
     and the value of each dictionary is a list representing the subset of instances that have that value for the attribute'''
+    if isinstance(instances, EncodedInstances):
+        # the partitions are views of slices of a shared index array (see EncodedInstances.partition)
+        partitions = defaultdict(lambda: instances.subset([]))
+        partitions.update(instances.partition(attribute_index))
+        return partitions
+    if isinstance(instances, InstanceBitsets):
+        partitions = defaultdict(lambda: instances._view(0, 0))
+        partitions.update(instances.partition(attribute_index))
+        return partitions
     partitions = defaultdict(list)
     for instance in instances:
         partitions[instance[attribute_index]].append(instance)
@@ -259,10 +1259,71 @@ def split_instances(instances, attribute_index):
 
 def partition_instances(instances, num_partitions):
     '''Returns a list of relatively equally sized disjoint sublists (partitions) of the list of instances'''
-    return [[instances[j] for j in range(i, len(instances), num_partitions)] for i in xrange(num_partitions)]
+    return [[instances[j] for j in range(i, len(instances), num_partitions)] for i in range(num_partitions)]
 
 
-def create_decision_tree(instances, candidate_attribute_indexes=None, class_index=0, default_class=None, trace=0):
+class BuildReport(object):
+    '''Counters and timers collected while a decision tree is built (see create_decision_tree).
+    
+    nodes, leaves: the number of nodes (including leaves) and leaves created
+    depth: the depth of the deepest node (the root is at depth 0)
+    rows_scanned: the total number of instances reaching each node
+    gain_evaluations: the number of information gains computed to choose the attributes of the nodes
+    seconds: the time taken to build the tree
+    encoding_seconds, split_search_seconds, partition_seconds: the time spent encoding the instances, 
+        choosing the best attribute of each node and partitioning the instances of each node among its children
+        (for a tree built in parallel, the times of the workers are added together)
+    
+    Each of the callbacks is called as callback(depth, num_instances, attribute_index, class_label) 
+    whenever a node is created: attribute_index is None for a leaf, and class_label is None for an internal node.'''
+
+    _counters = ('nodes', 'leaves', 'rows_scanned', 'gain_evaluations', 
+                 'encoding_seconds', 'split_search_seconds', 'partition_seconds')
+    
+    def __init__(self, callbacks=()):
+        self.callbacks = list(callbacks)
+        for name in self._counters:
+            setattr(self, name, 0.0 if name.endswith('_seconds') else 0)
+        self.depth = 0
+        self.seconds = 0.0
+        self._depth = 0  # the depth of the node being built
+        self._timing = False  # whether the time taken to build the whole tree is being measured
+
+    def __repr__(self):
+        return 'BuildReport({})'.format(', '.join('{}={!r}'.format(name, value) 
+                                                  for name, value in self.as_dict().items()))
+
+    def as_dict(self):
+        '''Returns a dictionary of the counters and timers'''
+        return dict([(name, getattr(self, name)) for name in self._counters] + 
+                    [('depth', self.depth), ('seconds', self.seconds)])
+    
+    def add_node(self, num_instances, attribute_index=None, class_label=None):
+        '''Records the creation of a node of num_instances instances at the current depth'''
+        self.nodes += 1
+        self.rows_scanned += num_instances
+        if attribute_index is None:
+            self.leaves += 1
+        self.depth = max(self.depth, self._depth)
+        for callback in self.callbacks:
+            callback(self._depth, num_instances, attribute_index, class_label)
+    
+    def merge(self, report, events=()):
+        '''Adds the counters of another report (e.g., of a subtree built by a worker process) to this one,
+        and calls the callbacks with the (depth, num_instances, attribute_index, class_label) tuples of events'''
+        for name in self._counters:
+            setattr(self, name, getattr(self, name) + getattr(report, name))
+        self.depth = max(self.depth, report.depth)
+        for event in events:
+            for callback in self.callbacks:
+                callback(*event)
+
+
+def create_decision_tree(instances, candidate_attribute_indexes=None, class_index=0, default_class=None, trace=0,
+                         n_jobs=1, min_parallel_instances=10000, report=None,
+                         max_depth=None, min_samples_split=2, min_gain=0.0, max_leaf_nodes=None, max_seconds=None,
+                         max_features=None, random_generator=None, missing_value=None, weights=None,
+                         use_bitsets=False):
     '''Returns a new decision tree trained on a list of instances.
     
     The tree is constructed by recursively selecting and splitting instances based on 
@@ -273,20 +1334,135 @@ def create_decision_tree(instances, candidate_attribute_indexes=None, class_inde
     The default_class is the majority value for the current node's parent in the tree.
     A positive (int) trace value will generate trace information with increasing levels of indentation.
     
+    The instances are encoded once (see EncodedInstances), and each node of the tree is built from 
+    a view of a slice of a single index array, which is partitioned in place as the tree grows.
+    (The index array is a new one, even if instances is a view of EncodedInstances, so the order of 
+    the caller's view, and of any weights that correspond to it, is unchanged.)
+    
+    If n_jobs is not 1, the tree is built by a pool of n_jobs processes (-1 for one per CPU), 
+    which share the encoded instances and the index array through shared memory rather than copies:
+    the information gains of the candidate attributes at the root are computed by the workers, and then 
+    each subtree (at any depth) with at least min_parallel_instances instances is built by a worker, 
+    concurrently with the others, unless it is larger than both 1/n_jobs of the instances and 
+    2 * min_parallel_instances, in which case its root is split by the calling process, and its subtrees 
+    are handled in the same way; so a large branch is divided among several workers rather than 
+    determining the time taken by the whole tree.
+    
+    If a BuildReport is provided as report, the numbers of nodes, instances and information gains 
+    and the time spent in each phase are added to it as the tree is built.
+    
+    The growth of the tree can be limited (pre-pruned), in which case a node that is not split 
+    is labeled with the majority value of its instances:
+    no node deeper than max_depth (the root is at depth 0) is split, nor is any node with fewer than 
+    min_samples_split instances, nor any node whose best attribute has an information gain less than min_gain.
+    If max_leaf_nodes or max_seconds is provided, the tree is grown best first (and in a single process):
+    the leaf whose best attribute has the greatest information gain is split next, until the tree has
+    max_leaf_nodes leaves or max_seconds have passed, so the tree keeps the most informative splits.
+    
+    If max_features is provided, the best attribute of each node is chosen from a random sample of 
+    (at most) max_features of its candidate attributes, drawn with random_generator (a random.Random object,
+    or the random module if it is None), as in the trees of a random forest (see create_random_forest).
+    
+    If missing_value is provided, it marks attribute values that are unknown, which are handled as in C4.5,
+    rather than as an ordinary value: the information gain of an attribute is computed from the instances 
+    whose value is known (see contingency_table_information_gain), and an instance whose value is unknown 
+    follows every branch of a node, with a fraction of its weight proportional to the weight of the 
+    instances that follow that branch. The branches of each node are then WeightedBranches, which record
+    those fractions so that classify and CompiledTree can classify instances with unknown values.
+    
+    If weights (a sequence of the weights of instances, in order) is provided, each instance counts as 
+    its weight wherever instances are counted: e.g., the distinct instances and counts returned by 
+    deduplicate_instances produce the same tree as the instances they were derived from, 
+    in time proportional to the number of distinct instances, and the instances of a rare class can be 
+    given greater weights. (min_samples_split then applies to the total weight of the instances of a node.)
+    
+    Trees grown with missing_value or weights are grown depth first, in a single process.
+    
+    If use_bitsets is true (or instances is an InstanceBitsets object), the instances are represented by 
+    the bitsets of InstanceBitsets, so that the instances of a node are a bitset, and the counts 
+    from which the information gains are computed are popcounts of ANDs of bitsets rather than scans 
+    of the instances (in a single process, without missing_value or weights).
+    
     Derived from the simplified ID3 algorithm presented in Building Decision Trees in Python by Christopher Roach,
     http://www.onlamp.com/pub/a/python/2006/02/09/ai_decision_trees.html?page=3'''
     
     # if no candidate_attribute_indexes are provided, assume that we will use all but the target_attribute_index
     if candidate_attribute_indexes is None:
-        candidate_attribute_indexes = [i for i in range(len(instances[0])) if i != class_index]
+        num_attributes = len(instances.vocabularies) if isinstance(instances, InstanceBitsets) else len(instances[0])
+        candidate_attribute_indexes = [i for i in range(num_attributes) if i != class_index]
         #candidate_attribute_indexes.remove(class_index)
-        
-    class_labels_and_counts = Counter([instance[class_index] for instance in instances])
+    
+    # time the construction of the whole tree (only in the outermost call)
+    if report is not None and not report._timing:
+        report._timing = True
+        start_time = default_timer()
+        try:
+            return create_decision_tree(instances, candidate_attribute_indexes, class_index, default_class, trace,
+                                        n_jobs, min_parallel_instances, report, 
+                                        max_depth, min_samples_split, min_gain, max_leaf_nodes, max_seconds,
+                                        max_features, random_generator, missing_value, weights, use_bitsets)
+        finally:
+            report._timing = False
+            report.seconds += default_timer() - start_time
+    
+    if use_bitsets or isinstance(instances, InstanceBitsets):
+        if missing_value is not None or weights is not None or n_jobs != 1:
+            raise ValueError('bitsets cannot be used with missing_value, weights or n_jobs')
+        if not isinstance(instances, InstanceBitsets):
+            if report is not None:
+                start_time = default_timer()
+            instances = InstanceBitsets(instances, class_index)
+            if report is not None:
+                report.encoding_seconds += default_timer() - start_time
+    else:
+        if report is not None:
+            start_time = default_timer()
+        instances = encode_instances(instances).indexed()
+        if report is not None:
+            report.encoding_seconds += default_timer() - start_time
+    
+    if missing_value is not None or weights is not None:
+        if max_leaf_nodes is not None or max_seconds is not None:
+            raise ValueError('max_leaf_nodes and max_seconds cannot be used with missing_value or weights')
+        if weights is not None:
+            weights = array('d', weights)
+            if len(weights) != len(instances):
+                raise ValueError('expected {} weights, found {}'.format(len(instances), len(weights)))
+        return _create_weighted_decision_tree(
+            instances, weights, candidate_attribute_indexes, class_index, default_class, missing_value, trace, report,
+            max_depth, min_samples_split, min_gain, max_features, random_generator)
+    
+    if max_leaf_nodes is not None or max_seconds is not None:
+        return _create_decision_tree_best_first(instances, candidate_attribute_indexes, class_index, default_class,
+                                                trace, report, max_depth, min_samples_split, min_gain, 
+                                                max_leaf_nodes, max_seconds, max_features, random_generator)
+    
+    if n_jobs != 1:
+        return _create_decision_tree_in_parallel(instances, candidate_attribute_indexes, class_index, default_class, 
+                                                 trace, n_jobs, min_parallel_instances, report,
+                                                 max_depth, min_samples_split, min_gain, 
+                                                 max_features, random_generator)
+    
+    return _create_decision_tree(instances, candidate_attribute_indexes, class_index, default_class, trace,
+                                 report=report, max_depth=max_depth, min_samples_split=min_samples_split, 
+                                 min_gain=min_gain, max_features=max_features, random_generator=random_generator)
+
+
+def _create_decision_tree(instances, candidate_attribute_indexes, class_index=0, default_class=None, trace=0,
+                          n_jobs=1, min_parallel_instances=10000, executor=None, report=None,
+                          max_depth=None, min_samples_split=2, min_gain=0.0, 
+                          max_features=None, random_generator=None):
+    '''Returns the (sub)tree of create_decision_tree for instances (a view of EncodedInstances whose slice
+    of the index array is partitioned in place, or InstanceBitsets), grown depth first; 
+    if executor is provided, large subtrees are built by its worker processes (see create_decision_tree).'''
+    class_labels_and_counts = _value_counts(instances, class_index)
 
     # If the dataset is empty or the candidate attributes list is empty, return the default value
     if not instances or not candidate_attribute_indexes:
         if trace:
             print('{}Using default class {}'.format('< ' * trace, default_class))
+        if report is not None:
+            report.add_node(len(instances), class_label=default_class)
         return default_class
     
     # If all the instances have the same class label, return that class label
@@ -294,60 +1470,959 @@ def create_decision_tree(instances, candidate_attribute_indexes=None, class_inde
         class_label = class_labels_and_counts.most_common(1)[0][0]
         if trace:
             print('{}All {} instances have label {}'.format('< ' * trace, 
-            	len(instances), class_label))
+                len(instances), class_label))
+        if report is not None:
+            report.add_node(len(instances), class_label=class_label)
+        return class_label
+    
+    # If the tree is already max_depth deep here, or there are too few instances to split, return the majority value
+    elif (max_depth is not None and max_depth <= 0) or len(instances) < min_samples_split:
+        class_label = class_labels_and_counts.most_common(1)[0][0]
+        if trace:
+            print('{}Stopping at {} instances with majority label {}'.format('< ' * trace, 
+                len(instances), class_label))
+        if report is not None:
+            report.add_node(len(instances), class_label=class_label)
         return class_label
     else:
-        default_class = simple_ml.majority_value(instances, class_index)
+        if report is not None:
+            start_time = default_timer()
+        default_class = majority_value(instances, class_index)
 
         # Choose the next best attribute index to best classify the instances
-        best_index = simple_ml.choose_best_attribute_index(instances, candidate_attribute_indexes, class_index)        
+        split_candidate_attribute_indexes = _split_candidate_attribute_indexes(
+            candidate_attribute_indexes, max_features, random_generator)
+        if executor is not None and instances.start == 0 and instances.end == len(instances.index):
+            # at the root (whose view covers the whole shared index) the workers are not yet building subtrees,
+            # so they compute the gains; below it, they are busy, and the gains are computed here
+            best_gain, best_index = _best_information_gain_and_index_in_parallel(
+                executor, n_jobs, instances, split_candidate_attribute_indexes, class_index)
+        else:
+            best_gain, best_index = best_information_gain_and_index(
+                instances, split_candidate_attribute_indexes, class_index)
+        if isinstance(instances, EncodedInstances):
+            instances.rows_getter = None  # the counts of this node are made, so its gathers are no longer needed
+        if report is not None:
+            report.split_search_seconds += default_timer() - start_time
+            report.gain_evaluations += len(split_candidate_attribute_indexes)
+        
+        # If even the best attribute is not informative enough, return the majority value
+        if min_gain and best_gain < min_gain:
+            if trace:
+                print('{}Stopping at {} instances with majority label {} (information gain {})'.format(
+                    '< ' * trace, len(instances), default_class, best_gain))
+            if report is not None:
+                report.add_node(len(instances), class_label=default_class)
+            return default_class
+        
         if trace:
             print('{}Creating tree node for attribute index {}'.format('> ' * trace, best_index))
+        if report is not None:
+            report.add_node(len(instances), best_index)
 
         # Create a new decision tree node with the best attribute index and an empty dictionary object (for now)
         tree = {best_index:{}}
 
         # Create a new decision tree sub-node (branch) for each of the values in the best attribute field
-        partitions = simple_ml.split_instances(instances, best_index)
+        if report is not None:
+            start_time = default_timer()
+        partitions = split_instances(instances, best_index)
+        if report is not None:
+            report.partition_seconds += default_timer() - start_time
+            report._depth += 1
 
         # Remove that attribute from the set of candidates for further splits
         remaining_candidate_attribute_indexes = [i for i in candidate_attribute_indexes if i != best_index]
-        for attribute_value in partitions:
+        remaining_depth = max_depth - 1 if max_depth is not None else None
+        if executor is not None:  # subtrees larger than this are split further here (see above)
+            max_parallel_instances = max(2 * min_parallel_instances, len(instances.index) // n_jobs)
+        for attribute_value in list(partitions):
+            # each child is removed once its subtree is built, so its cached gathers (if any) are released
+            child_instances = partitions.pop(attribute_value)
             if trace:
                 print('{}Creating subtree for value {} ({}, {}, {}, {})'.format(
                     '> ' * trace,
                     attribute_value, 
-                    len(partitions[attribute_value]), 
+                    len(child_instances), 
                     len(remaining_candidate_attribute_indexes), 
                     class_index, 
                     default_class))
                 
-            # Create a subtree for each value of the the best attribute
-            subtree = create_decision_tree(
-                partitions[attribute_value],
-                remaining_candidate_attribute_indexes,
-                class_index,
-                default_class,
-                trace + 1 if trace else 0)
+            # Create a subtree for each value of the the best attribute 
+            # (or, for large subtrees of a tree built in parallel, a future result)
+            if executor is not None and len(child_instances) > max_parallel_instances:
+                subtree = _create_decision_tree(
+                    child_instances,
+                    remaining_candidate_attribute_indexes,
+                    class_index,
+                    default_class,
+                    trace + 1 if trace else 0,
+                    n_jobs,
+                    min_parallel_instances,
+                    executor,
+                    report,
+                    max_depth=remaining_depth,
+                    min_samples_split=min_samples_split,
+                    min_gain=min_gain,
+                    max_features=max_features,
+                    random_generator=random_generator)
+            elif executor is not None and len(child_instances) >= min_parallel_instances:
+                subtree = executor.submit(
+                    _create_shared_subtree,
+                    child_instances.start,
+                    child_instances.end,
+                    remaining_candidate_attribute_indexes,
+                    class_index,
+                    default_class,
+                    trace + 1 if trace else 0,
+                    report._depth if report is not None else None,
+                    remaining_depth,
+                    min_samples_split,
+                    min_gain,
+                    max_features,
+                    # each worker draws its samples with its own generator, seeded from this one
+                    random.Random((random_generator or random).getrandbits(64)) if max_features else None)
+            else:
+                subtree = _create_decision_tree(
+                    child_instances,
+                    remaining_candidate_attribute_indexes,
+                    class_index,
+                    default_class,
+                    trace + 1 if trace else 0,
+                    report=report,
+                    max_depth=remaining_depth,
+                    min_samples_split=min_samples_split,
+                    min_gain=min_gain,
+                    max_features=max_features,
+                    random_generator=random_generator)
 
             # Add the new subtree to the empty dictionary object in the new tree/node we just created
             tree[best_index][attribute_value] = subtree
+        if report is not None:
+            report._depth -= 1
 
     return tree
 
 
-def classify(tree, instance, default_class=None):
-    '''Returns a classification label for instance, given a decision tree'''
+class WeightedBranches(dict):
+    '''The branches of a node of a decision tree grown with missing values (see create_decision_tree):
+    a dictionary mapping each value of the node's attribute to a subtree, whose weights attribute maps
+    each value to the fraction of the (weight of the) training instances with a known value that had that value.'''
+    
+    def __init__(self, branches=(), weights=None):
+        dict.__init__(self, branches)
+        self.weights = weights if weights is not None else {}
+    
+    def __reduce__(self):
+        return self.__class__, (dict(self), self.weights)
+
+
+def _create_weighted_decision_tree(instances, weights, candidate_attribute_indexes, class_index, 
+                                   default_class, missing_value, trace, report, 
+                                   max_depth, min_samples_split, min_gain, max_features, random_generator):
+    '''Returns a new decision tree trained on instances (a view of EncodedInstances) whose weights are weights
+    (an array parallel to the view, or None if they are all 1), treating missing_value (if it is not None)
+    as unknown (C4.5).
+    
+    Each child of a node is a view of the instances over a new array of positions: those of the instances 
+    with the child's value, followed by those of the instances whose value is unknown, with their weights
+    scaled by the fraction of the known weight that has the child's value. No instances are copied.'''
+    class_weights = _value_counts(instances, class_index, weights)
+    total_weight = math.fsum(class_weights.values())
+    
+    if not instances or not candidate_attribute_indexes:
+        class_label = default_class
+    elif len(class_weights) == 1:
+        class_label = next(iter(class_weights))
+    else:
+        class_label = class_weights.most_common(1)[0][0]
+        if (max_depth is None or max_depth > 0) and total_weight >= min_samples_split:
+            if report is not None:
+                start_time = default_timer()
+            split_candidate_attribute_indexes = _split_candidate_attribute_indexes(
+                candidate_attribute_indexes, max_features, random_generator)
+            best_gain, best_index = best_information_gain_and_index(
+                instances, split_candidate_attribute_indexes, class_index, weights, missing_value)
+            instances.rows_getter = None  # the counts of this node are made, so its gathers are no longer needed
+            if report is not None:
+                report.split_search_seconds += default_timer() - start_time
+                report.gain_evaluations += len(split_candidate_attribute_indexes)
+            if not (min_gain and best_gain < min_gain):
+                tree = _split_weighted(
+                    instances, weights, best_index, candidate_attribute_indexes, class_index, class_label, 
+                    missing_value, trace, report, max_depth, min_samples_split, min_gain, max_features, 
+                    random_generator)
+                if tree is not None:
+                    return tree
+    if trace:
+        print('{}{} instances (weight {}) have label {}'.format('< ' * trace, len(instances), total_weight, 
+                                                               class_label))
+    if report is not None:
+        report.add_node(len(instances), class_label=class_label)
+    return class_label
+
+
+def _split_weighted(instances, weights, best_index, candidate_attribute_indexes, class_index, 
+                    majority, missing_value, trace, report, 
+                    max_depth, min_samples_split, min_gain, max_features, random_generator):
+    '''Returns a node of _create_weighted_decision_tree that splits instances on best_index, 
+    or None if none of the instances have a known value of best_index'''
+    if report is not None:
+        start_time = default_timer()
+    # group the positions (in the view) of the instances by their value of best_index
+    codes = instances.column_codes(best_index)
+    instances.rows_getter = None
+    vocabulary = instances.vocabularies[best_index]
+    positions_by_code = defaultdict(list)
+    for position, code in enumerate(codes):
+        positions_by_code[code].append(position)
+    missing_positions = []
+    if missing_value is not None:
+        for code in list(positions_by_code):
+            if vocabulary[code] == missing_value:
+                missing_positions = positions_by_code.pop(code)
+    if not positions_by_code:
+        return None
+    if weights is None:
+        code_weights = dict((code, float(len(positions))) for code, positions in positions_by_code.items())
+    else:
+        code_weights = dict((code, math.fsum(map(weights.__getitem__, positions))) 
+                            for code, positions in positions_by_code.items())
+    known_weight = math.fsum(code_weights.values())
+    if report is not None:
+        report.partition_seconds += default_timer() - start_time
+    if trace:
+        print('{}Creating tree node for attribute index {} ({} instances with unknown values)'.format(
+            '> ' * trace, best_index, len(missing_positions)))
+    if report is not None:
+        report.add_node(len(instances), best_index)
+        report._depth += 1
+    
+    remaining_candidate_attribute_indexes = [i for i in candidate_attribute_indexes if i != best_index]
+    branches = WeightedBranches() if missing_value is not None else {}
+    for code in sorted(positions_by_code, key=lambda code: positions_by_code[code][0]):  # in order of appearance
+        positions = positions_by_code[code]
+        fraction = code_weights[code] / known_weight
+        if missing_value is not None:
+            branches.weights[vocabulary[code]] = fraction
+        if weights is None and not missing_positions:
+            child_weights = None
+        else:
+            child_weights = array('d', repeat(1.0, len(positions)) if weights is None
+                                  else map(weights.__getitem__, positions))
+            child_weights.extend(fraction * weights[position] if weights is not None else fraction 
+                                 for position in missing_positions)
+        branches[vocabulary[code]] = _create_weighted_decision_tree(
+            instances.view(positions + missing_positions), child_weights, 
+            remaining_candidate_attribute_indexes, class_index, majority, missing_value, 
+            trace + 1 if trace else 0, report, max_depth - 1 if max_depth is not None else None, 
+            min_samples_split, min_gain, max_features, random_generator)
+    if report is not None:
+        report._depth -= 1
+    return {best_index: branches}
+
+
+def _create_decision_tree_best_first(instances, candidate_attribute_indexes, class_index, default_class, trace,
+                                     report, max_depth, min_samples_split, min_gain, max_leaf_nodes, max_seconds,
+                                     max_features=None, random_generator=None):
+    '''Returns a new decision tree trained on instances (a view of EncodedInstances), grown best first.
+    
+    Each leaf that can be split is kept in a priority queue (a heap), ordered by the information gain of 
+    its best attribute, and is labeled with its majority value until it is split. Growth stops when 
+    the queue is empty, when the tree has max_leaf_nodes leaves or when max_seconds have passed.
+    If the best attribute of a leaf has more values than the remaining number of leaves allows,
+    the leaf is split on the best attribute that fits instead, once it is the leaf with the greatest gain 
+    for that attribute (or is not split, if none fits).
+    With no limits, the tree is the same as the one grown depth first.'''
+    start_time = default_timer()
+    root = [default_class]  # a slot for the tree, so that every node is the value of a slot in its parent
+    frontier = []  # a heap of (-gain, sequence number, node) tuples; ties are split in the order nodes were found
+    sequence_numbers = count()
+    
+    def best_split(splits, num_leaves):
+        # the (gain, attribute index) of the best of splits that is informative enough and, 
+        # replacing a leaf with its children, leaves at most max_leaf_nodes leaves, or None
+        for gain, attribute_index, num_children in splits:
+            if min_gain and gain < min_gain:
+                return None
+            if max_leaf_nodes is None or num_leaves - 1 + num_children <= max_leaf_nodes:
+                return gain, attribute_index
+        return None
+    
+    def add_leaf(instances, candidate_attribute_indexes, default_class, depth, slot, key):
+        # label a new leaf, and add it to the frontier if it can be split
+        class_labels_and_counts = _value_counts(instances, class_index)
+        if not instances or not candidate_attribute_indexes:
+            slot[key] = default_class
+        elif len(class_labels_and_counts) == 1 or \
+                (max_depth is not None and depth >= max_depth) or len(instances) < min_samples_split:
+            slot[key] = class_labels_and_counts.most_common(1)[0][0]
+        else:
+            slot[key] = class_labels_and_counts.most_common(1)[0][0]
+            if report is not None:
+                split_start_time = default_timer()
+            split_candidate_attribute_indexes = _split_candidate_attribute_indexes(
+                candidate_attribute_indexes, max_features, random_generator)
+            # the (gain, attribute index, number of children) of each candidate split, best first
+            # (in the order of best_information_gain_and_index)
+            tables = contingency_tables(instances, split_candidate_attribute_indexes, class_index)
+            splits = sorted([(contingency_table_information_gain(tables[i]), i, len(tables[i])) 
+                             for i in split_candidate_attribute_indexes], 
+                            reverse=True)
+            if isinstance(instances, EncodedInstances):
+                instances.rows_getter = None  # the leaf may wait in the frontier, so its gathers are released
+            if report is not None:
+                report.split_search_seconds += default_timer() - split_start_time
+                report.gain_evaluations += len(split_candidate_attribute_indexes)
+            best_gain = splits[0][0]
+            if not (min_gain and best_gain < min_gain):
+                heapq.heappush(frontier, (-best_gain, next(sequence_numbers), 
+                                          (instances, candidate_attribute_indexes, splits, depth, slot, key)))
+                return
+        leaves.append((len(instances), depth, slot[key]))
+    
+    leaves = []  # the (number of instances, depth, class label) of each leaf that will not be split
+    add_leaf(instances, candidate_attribute_indexes, default_class, 0, root, 0)
+    while frontier:
+        num_leaves = len(leaves) + len(frontier)
+        if (max_leaf_nodes is not None and num_leaves >= max_leaf_nodes) or \
+                (max_seconds is not None and default_timer() - start_time >= max_seconds):
+            break
+        priority, _, node = heapq.heappop(frontier)
+        instances, candidate_attribute_indexes, splits, depth, slot, key = node
+        split = best_split(splits, num_leaves)
+        if split is None:
+            leaves.append((len(instances), depth, slot[key]))  # no split fits: leave it as a leaf
+            continue
+        best_gain, best_index = split
+        if best_gain < -priority:
+            # the best split has too many children, so the leaf waits for its turn with the next best one
+            heapq.heappush(frontier, (-best_gain, next(sequence_numbers), node))
+            continue
+        if report is not None:
+            partition_start_time = default_timer()
+        partitions = split_instances(instances, best_index)
+        if report is not None:
+            report.partition_seconds += default_timer() - partition_start_time
+        if trace:
+            print('{}Creating tree node for attribute index {} (information gain {}, depth {})'.format(
+                '> ' * trace, best_index, best_gain, depth))
+        if report is not None:
+            report._depth = depth
+            report.add_node(len(instances), best_index)
+        majority = slot[key]
+        slot[key] = tree = {best_index: {}}
+        remaining_candidate_attribute_indexes = [i for i in candidate_attribute_indexes if i != best_index]
+        for attribute_value in partitions:
+            add_leaf(partitions[attribute_value], remaining_candidate_attribute_indexes, majority, depth + 1,
+                     tree[best_index], attribute_value)
+    
+    # the leaves that were never split
+    leaves.extend((len(node[0]), node[3], node[4][node[5]]) for _, _, node in frontier)
+    for num_instances, depth, class_label in leaves:
+        if trace:
+            print('{}{} instances have majority label {} (depth {})'.format('< ' * trace, 
+                num_instances, class_label, depth))
+        if report is not None:
+            report._depth = depth
+            report.add_node(num_instances, class_label=class_label)
+    if report is not None:
+        report._depth = 0
+    return root[0]
+
+
+def _create_decision_tree_in_parallel(instances, candidate_attribute_indexes, class_index, default_class, 
+                                      trace, n_jobs, min_parallel_instances, report=None,
+                                      max_depth=None, min_samples_split=2, min_gain=0.0, 
+                                      max_features=None, random_generator=None):
+    '''Returns a new decision tree trained on instances (a view of EncodedInstances) by a pool of n_jobs processes.
+    
+    The codes of the instances and the index array are copied into a block of shared memory, which each worker
+    attaches to when it starts, so the workers can read the instances and partition disjoint slices 
+    of the index array without any instances being pickled.'''
+    from concurrent.futures import ProcessPoolExecutor
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    shared_memory, shared_instances_spec = _share_instances(instances)
+    try:
+        shared_instances = _attach_instances(shared_memory, shared_instances_spec)
+        with ProcessPoolExecutor(n_jobs, initializer=_attach_shared_instances, 
+                                 initargs=(shared_instances_spec,)) as executor:
+            # the subtrees built by workers are futures until the whole tree has been dispatched,
+            # so that waiting for one does not delay the dispatch of the others
+            tree = _create_decision_tree(shared_instances, candidate_attribute_indexes, class_index, default_class, 
+                                         trace, n_jobs, min_parallel_instances, executor, report,
+                                         max_depth, min_samples_split, min_gain, 
+                                         max_features=max_features, random_generator=random_generator)
+            return _resolve_subtrees(tree, report)
+    finally:
+        shared_instances = None
+        _release_shared_memory(shared_memory, unlink=True)
+
+
+def _resolve_subtrees(tree, report=None):
+    '''Returns tree, with the futures of the subtrees built by worker processes replaced by the subtrees
+    (and their reports merged into report)'''
+    from concurrent.futures import Future
+    if isinstance(tree, Future):
+        tree = tree.result()
+        if report is not None:  # the subtree, the worker's report and its node events
+            tree, subtree_report, events = tree
+            report.merge(subtree_report, events)
+        return tree
+    if isinstance(tree, dict):
+        for value_subtrees in tree.values():
+            for attribute_value, subtree in value_subtrees.items():
+                value_subtrees[attribute_value] = _resolve_subtrees(subtree, report)
+    return tree
+
+
+def _share_instances(instances):
+    '''Returns a new SharedMemory block containing the codes of instances (a view of EncodedInstances) 
+    and an index array of their positions, and a (picklable) description of its contents'''
+    from multiprocessing.shared_memory import SharedMemory
+    columns = [instances.column_codes(i) for i in range(len(instances.columns))]
+    index = _index_array(range(len(instances)))
+    typecodes = [_typecode(column) for column in columns] + [_typecode(index)]
+    offsets = [0]
+    for column in columns + [index]:  # each array is aligned on an 8 byte boundary
+        offsets.append(offsets[-1] + (len(column) * column.itemsize + 7) // 8 * 8)
+    shared_memory = SharedMemory(create=True, size=max(offsets[-1], 1))
+    for column, offset in zip(columns + [index], offsets):
+        shared_memory.buf[offset:offset + len(column) * column.itemsize] = column.tobytes()
+    return shared_memory, (shared_memory.name, len(instances), typecodes, offsets, instances.vocabularies)
+
+
+def _attach_instances(shared_memory, shared_instances_spec):
+    '''Returns a view of the EncodedInstances in shared_memory (see _share_instances), covering all of them'''
+    _, num_instances, typecodes, offsets, vocabularies = shared_instances_spec
+    arrays = [shared_memory.buf[offset:offset + num_instances * array(typecode).itemsize].cast(typecode)
+              for typecode, offset in zip(typecodes, offsets)]
+    instances = EncodedInstances(arrays[:-1], vocabularies)
+    return instances._view(arrays[-1], 0, num_instances)
+
+
+def _release_shared_memory(shared_memory, unlink=False):
+    '''Closes shared_memory (a SharedMemory block), after removing it if unlink is true.
+    
+    Views of the block that are still referenced (e.g., by the frames of the traceback of an exception 
+    that is being raised) prevent it from being closed; it is then closed when they are released, 
+    rather than the BufferError hiding the exception (and leaving the block in place).'''
+    try:
+        if unlink:
+            shared_memory.unlink()
+    finally:
+        try:
+            shared_memory.close()
+        except BufferError:
+            pass
+
+
+_shared_instances = None  # in a worker process, the view of the instances in shared memory
+
+
+def _attach_shared_instances(shared_instances_spec):
+    '''Initializes a worker process by attaching to the shared memory block described by shared_instances_spec'''
+    global _shared_instances
+    from multiprocessing.shared_memory import SharedMemory
+    shared_memory = SharedMemory(shared_instances_spec[0])
+    _shared_instances = _attach_instances(shared_memory, shared_instances_spec)
+    _shared_instances.shared_memory = shared_memory  # keeps the block open as long as the view exists
+
+
+def _create_shared_subtree(start, end, candidate_attribute_indexes, class_index, default_class, trace, depth=None,
+                           max_depth=None, min_samples_split=2, min_gain=0.0, 
+                           max_features=None, random_generator=None):
+    '''Returns the subtree (built in a worker process) for the shared instances at index[start:end].
+    
+    If the depth of the subtree is provided, its BuildReport and the list of its node events 
+    are also returned, to be merged into the report of the whole tree.'''
+    instances = _shared_instances._view(_shared_instances.index, start, end)
+    if depth is None:
+        return _create_decision_tree(instances, candidate_attribute_indexes, class_index, default_class, trace,
+                                     max_depth=max_depth, min_samples_split=min_samples_split, min_gain=min_gain,
+                                     max_features=max_features, random_generator=random_generator)
+    events = []
+    report = BuildReport([lambda *event: events.append(event)])
+    report._depth = depth
+    subtree = _create_decision_tree(instances, candidate_attribute_indexes, class_index, default_class, trace,
+                                    report=report, 
+                                    max_depth=max_depth, min_samples_split=min_samples_split, min_gain=min_gain,
+                                    max_features=max_features, random_generator=random_generator)
+    report.callbacks = []  # the callback cannot be pickled
+    return subtree, report, events
+
+
+def _shared_information_gains(start, end, attribute_indexes, class_index):
+    '''Returns a list of (information gain, attribute index) tuples, computed in a worker process, 
+    for the shared instances at index[start:end]'''
+    instances = _shared_instances._view(_shared_instances.index, start, end)
+    tables = contingency_tables(instances, attribute_indexes, class_index)
+    return [(contingency_table_information_gain(tables[i]), i) for i in attribute_indexes]
+
+
+def _best_information_gain_and_index_in_parallel(executor, n_jobs, instances, candidate_attribute_indexes, 
+                                                 class_index):
+    '''Returns the result of best_information_gain_and_index for shared instances, 
+    with the candidate attributes divided among the workers of executor'''
+    chunks = [candidate_attribute_indexes[i::n_jobs] for i in range(n_jobs)]
+    futures = [executor.submit(_shared_information_gains, instances.start, instances.end, chunk, class_index)
+               for chunk in chunks if chunk]
+    gains_and_indexes = sorted([gain_and_index for future in futures for gain_and_index in future.result()],
+                               reverse=True)
+    return gains_and_indexes[0]
+
+
+def classify(tree, instance, default_class=None, missing_value=None):
+    '''Returns a classification label for instance, given a decision tree.
+    
+    If the tree was grown with missing_value (see create_decision_tree), an instance whose value 
+    of a node's attribute is missing_value is classified by every branch of the node, and the label
+    with the greatest total weight (see WeightedBranches) is returned.'''
     if not tree:
         return default_class
     if not isinstance(tree, dict): 
         return tree
-    attribute_index = list(tree.keys())[0]  # using list(dict.keys()) for Python 3 compatibiity
-    attribute_values = list(tree.values())[0]
+    attribute_index, attribute_values = next(iter(tree.items()))  # the only item, without copying keys or values
     instance_attribute_value = instance[attribute_index]
     if instance_attribute_value not in attribute_values:
+        if (missing_value is not None and instance_attribute_value == missing_value 
+                and isinstance(attribute_values, WeightedBranches)):
+            class_weights = Counter()
+            _add_class_weights(tree, instance, default_class, missing_value, 1.0, class_weights)
+            return class_weights.most_common(1)[0][0]
         return default_class
-    return classify(attribute_values[instance_attribute_value], instance, default_class)
+    return classify(attribute_values[instance_attribute_value], instance, default_class, missing_value)
+
+
+def _add_class_weights(tree, instance, default_class, missing_value, weight, class_weights):
+    # adds weight to the class label that tree assigns to instance in class_weights,
+    # dividing it among the branches of the nodes whose attribute value is missing
+    if not tree or not isinstance(tree, dict):
+        class_weights[tree if tree else default_class] += weight
+        return
+    attribute_index, attribute_values = next(iter(tree.items()))
+    instance_attribute_value = instance[attribute_index]
+    if instance_attribute_value in attribute_values:
+        _add_class_weights(attribute_values[instance_attribute_value], instance, default_class, missing_value, 
+                           weight, class_weights)
+    elif instance_attribute_value == missing_value and isinstance(attribute_values, WeightedBranches):
+        for value, subtree in attribute_values.items():
+            _add_class_weights(subtree, instance, default_class, missing_value, 
+                               weight * attribute_values.weights[value], class_weights)
+    else:
+        class_weights[default_class] += weight
+
+
+class CompiledTree(object):
+    '''A decision tree flattened into parallel arrays, for classifying batches of instances.
+    
+    The nodes are numbered in breadth-first order, starting with the root (node 0).
+    For each node n:
+        attribute_indexes[n] is the index of the attribute tested at n, or -1 if n is a leaf
+        child_offsets[n] is the position in children of the child of n for the value with code 0, 
+            so that children[child_offsets[n] + code] is the child of n for the value with code code, 
+            or -1 if the tree has no branch for that value
+        labels[n] is the position in class_labels of the label of leaf n, or -1 for the default class
+        weights[n] (for a tree grown with missing_value) is the fraction of its parent's weight 
+            that follows the branch to n when the value of the parent's attribute is missing_value
+    vocabularies[i] is the list of values of attribute i, whose positions are the codes used by children.'''
+    
+    def __init__(self, attribute_indexes, child_offsets, children, labels, class_labels, vocabularies,
+                 weights=None, missing_value=None):
+        self.attribute_indexes = attribute_indexes
+        self.child_offsets = child_offsets
+        self.children = children
+        self.labels = labels
+        self.class_labels = class_labels
+        self.vocabularies = vocabularies
+        self.weights = weights
+        self.missing_value = missing_value
+        self.value_codes = [dict((value, code) for code, value in enumerate(vocabulary)) 
+                            for vocabulary in vocabularies]
+    
+    def __len__(self):
+        return len(self.attribute_indexes)
+    
+    def tree(self, node=0):
+        '''Returns the subtree at node (by default, the whole tree) in the nested dictionary representation 
+        used by create_decision_tree (with None for the default class)'''
+        attribute_index = self.attribute_indexes[node]
+        if attribute_index < 0:
+            label = self.labels[node]
+            return self.class_labels[label] if label >= 0 else None
+        child_offset = self.child_offsets[node]
+        value_subtrees = {} if self.weights is None else WeightedBranches()
+        for code, value in enumerate(self.vocabularies[attribute_index]):
+            child = self.children[child_offset + code]
+            if child >= 0:
+                value_subtrees[value] = self.tree(child)
+                if self.weights is not None:
+                    value_subtrees.weights[value] = self.weights[child]
+        return {attribute_index: value_subtrees}
+    
+    def classify(self, instance, default_class=None):
+        '''Returns a classification label for instance'''
+        node = 0
+        attribute_index = self.attribute_indexes[node]
+        while attribute_index >= 0:
+            if self.weights is not None and instance[attribute_index] == self.missing_value:
+                class_weights = Counter()
+                self._add_class_weights(node, instance, default_class, 1.0, class_weights)
+                return class_weights.most_common(1)[0][0]
+            code = self.value_codes[attribute_index].get(instance[attribute_index])
+            if code is None:
+                return default_class
+            node = self.children[self.child_offsets[node] + code]
+            if node < 0:
+                return default_class
+            attribute_index = self.attribute_indexes[node]
+        label = self.labels[node]
+        return self.class_labels[label] if label >= 0 else default_class
+    
+    def _add_class_weights(self, node, instance, default_class, weight, class_weights):
+        # adds weight to the class label that the subtree at node assigns to instance in class_weights
+        # (see classify, the function)
+        attribute_index = self.attribute_indexes[node]
+        while attribute_index >= 0:
+            child_offset = self.child_offsets[node]
+            if instance[attribute_index] == self.missing_value:
+                for code in range(len(self.vocabularies[attribute_index])):
+                    child = self.children[child_offset + code]
+                    if child >= 0:
+                        self._add_class_weights(child, instance, default_class, weight * self.weights[child], 
+                                                class_weights)
+                return
+            code = self.value_codes[attribute_index].get(instance[attribute_index])
+            node = self.children[child_offset + code] if code is not None else -1
+            if node < 0:
+                class_weights[default_class] += weight
+                return
+            attribute_index = self.attribute_indexes[node]
+        label = self.labels[node]
+        class_weights[self.class_labels[label] if label >= 0 else default_class] += weight
+    
+    def predict_batch(self, instances, default_class=None):
+        '''Returns a list of the classification labels of instances (a list of instances or EncodedInstances).
+        
+        Rather than walking the tree once per instance, the instances reaching each node are split among 
+        its children all at once: the values (or codes) of the node's attribute are gathered 
+        for the positions of its instances (with operator.itemgetter), and the positions are appended 
+        to a list per value in a single pass, so the work per node is proportional to its number of instances.
+        Instances that reach a node whose attribute value is missing (in a tree grown with missing_value)
+        are set aside, and then classified one at a time.'''
+        predictions = [default_class] * len(instances)
+        if not predictions:
+            return predictions
+        encoded = isinstance(instances, EncodedInstances)
+        tree_code_getters = {}  # attribute index -> a function of an instance value (or code) to a tree code
+        attribute_codes = {}  # attribute index -> the codes of EncodedInstances (gathered once, for a view)
+        missing_code = -2 if self.weights is not None else None  # the tree code of missing_value
+        missing_positions = []
+        nodes = [(0, None)]  # (node, positions of its instances in instances, or None for all of them)
+        while nodes:
+            node, positions = nodes.pop()
+            attribute_index = self.attribute_indexes[node]
+            if attribute_index < 0:
+                label = self.labels[node]
+                if label >= 0:
+                    class_label = self.class_labels[label]
+                    if positions is None:
+                        predictions = [class_label] * len(predictions)
+                    else:
+                        for position in positions:
+                            predictions[position] = class_label
+                continue
+            if attribute_index not in tree_code_getters:
+                value_codes = self.value_codes[attribute_index]
+                if missing_code is not None:
+                    value_codes = dict(value_codes)
+                    value_codes[self.missing_value] = missing_code
+                if encoded:
+                    attribute_codes[attribute_index] = instances.column_codes(attribute_index)
+                    tree_code_getters[attribute_index] = [
+                        value_codes.get(value, -1) for value in instances.vocabularies[attribute_index]].__getitem__
+                else:
+                    tree_code_getters[attribute_index] = lambda value, value_codes=value_codes: \
+                        value_codes.get(value, -1)
+            if positions is None:
+                positions = range(len(predictions))
+                rows = instances
+            else:
+                rows = _items_getter(positions)(instances) if not encoded else None
+            if encoded:
+                codes = attribute_codes[attribute_index]
+                keys = codes if rows is instances else _items_getter(positions)(codes)
+            else:
+                keys = list(map(operator.itemgetter(attribute_index), rows))
+            distinct_keys = set(keys)
+            if len(distinct_keys) == 1:
+                key_positions = {next(iter(distinct_keys)): positions}
+            else:  # group the positions by key in one pass
+                appenders = dict((key, _index_array(()).append) for key in distinct_keys)
+                for position, key in zip(positions, keys):
+                    appenders[key](position)
+                key_positions = dict((key, append.__self__) for key, append in appenders.items())
+            child_offset = self.child_offsets[node]
+            tree_code_getter = tree_code_getters[attribute_index]
+            for key, child_positions in key_positions.items():
+                tree_code = tree_code_getter(key)
+                if tree_code >= 0:
+                    child = self.children[child_offset + tree_code]
+                    if child >= 0:
+                        nodes.append((child, child_positions))
+                elif tree_code == missing_code:
+                    missing_positions.extend(child_positions)
+                # otherwise, an unknown value: the instances keep the default class
+        for position in missing_positions:
+            predictions[position] = self.classify(instances[position], default_class)
+        return predictions
+
+
+def compile_tree(tree, vocabularies=None, missing_value=None):
+    '''Returns a CompiledTree equivalent to tree (as created by create_decision_tree).
+    
+    If vocabularies (e.g., those of the EncodedInstances used to create tree) are provided,
+    the codes of their values are preserved; any other values in tree are assigned new codes.
+    If tree was grown with missing_value, the weights of its branches are compiled too.'''
+    vocabularies = [list(vocabulary) for vocabulary in vocabularies] if vocabularies else []
+    value_codes = [dict((value, code) for code, value in enumerate(vocabulary)) for vocabulary in vocabularies]
+    # first pass: collect the values of each attribute, so that the size of every child table is known
+    nodes = [tree]
+    for node in nodes:
+        if isinstance(node, dict) and node:
+            attribute_index, value_subtrees = next(iter(node.items()))
+            while len(vocabularies) <= attribute_index:
+                vocabularies.append([])
+                value_codes.append({})
+            for value in value_subtrees:
+                if value not in value_codes[attribute_index]:
+                    value_codes[attribute_index][value] = len(vocabularies[attribute_index])
+                    vocabularies[attribute_index].append(value)
+            nodes.extend(value_subtrees.values())
+    # second pass: nodes is in breadth-first order, so each node's children are numbered consecutively
+    attribute_indexes, child_offsets, labels = array('i'), array('i'), array('i')
+    children = array('i')
+    weights = None
+    if missing_value is not None:
+        weights = array('d', [1.0])
+    class_labels, class_codes = [], {}
+    next_node = 1
+    for node in nodes:
+        if isinstance(node, dict) and node:
+            attribute_index, value_subtrees = next(iter(node.items()))
+            attribute_indexes.append(attribute_index)
+            child_offsets.append(len(children))
+            labels.append(-1)
+            node_children = array('i', [-1]) * len(vocabularies[attribute_index])
+            for value in value_subtrees:
+                node_children[value_codes[attribute_index][value]] = next_node
+                next_node += 1
+                if weights is not None:
+                    weights.append(value_subtrees.weights[value] if isinstance(value_subtrees, WeightedBranches)
+                                   else 1.0)
+            children.extend(node_children)
+        else:
+            attribute_indexes.append(-1)
+            child_offsets.append(-1)
+            if not node:  # classify() returns the default class for an empty (or false) subtree
+                labels.append(-1)
+            else:
+                if node not in class_codes:
+                    class_codes[node] = len(class_labels)
+                    class_labels.append(node)
+                labels.append(class_codes[node])
+    return CompiledTree(attribute_indexes, child_offsets, children, labels, class_labels, vocabularies,
+                        weights, missing_value)
+
+
+_COMPILED_TREE_MAGIC = b'SIMPLEML-TREE-1\n'
+
+
+def save_compiled_tree(filename, tree, default_class=None):
+    '''Saves a CompiledTree (and the class label to use by default) to a binary file 
+    that can be memory-mapped by load_compiled_tree.
+    
+    The arrays of the tree are saved in the format of save_encoded_instances, and its class labels 
+    and vocabularies in the JSON header, so they should be strings (or other JSON values).'''
+    header = {'class_labels': tree.class_labels,
+              'vocabularies': tree.vocabularies,
+              'default_class': default_class,
+              'missing_value': tree.missing_value}
+    arrays = [array('i', values) for values in (tree.attribute_indexes, tree.child_offsets, 
+                                                tree.children, tree.labels)]
+    if tree.weights is not None:
+        arrays.append(array('d', tree.weights))
+    _save_arrays(filename, _COMPILED_TREE_MAGIC, header, arrays)
+
+
+def load_compiled_tree(filename):
+    '''Returns the CompiledTree saved in a file by save_compiled_tree, and the default class label.
+    
+    The arrays of the tree are memoryviews of the (read-only) memory-mapped file, so loading a tree 
+    takes time proportional to the size of its vocabularies rather than its number of nodes, 
+    and processes that load the same file share one copy of the tree.'''
+    header, arrays = _load_arrays(filename, _COMPILED_TREE_MAGIC, 'a file of a compiled tree')
+    weights = arrays[4] if len(arrays) > 4 else None
+    tree = CompiledTree(*(arrays[:4] + [header['class_labels'], header['vocabularies'], 
+                                        weights, header.get('missing_value')]))
+    return tree, header['default_class']
+
+
+def tree_to_json(tree, attribute_names=None, indent=2):
+    '''Returns a JSON string representing a decision tree (as created by create_decision_tree), for inspection.
+    
+    Each internal node is an object with the "attribute" it tests (its name in attribute_names, if provided,
+    otherwise its index) and the subtree for each of its "values"; each leaf is a class label.
+    The nodes of a tree grown with missing values also have the "weights" of their values (see WeightedBranches).
+    attribute_names may also be an AttributeSchema.'''
+    attribute_names = _attribute_names(attribute_names)
+    
+    def node_object(node):
+        if not isinstance(node, dict) or not node:
+            return node if node else None
+        attribute_index, value_subtrees = next(iter(node.items()))
+        result = {'attribute': attribute_names[attribute_index] if attribute_names else attribute_index,
+                  'values': dict((value, node_object(subtree)) for value, subtree in value_subtrees.items())}
+        if isinstance(value_subtrees, WeightedBranches):
+            result['weights'] = value_subtrees.weights
+        return result
+    
+    return json.dumps(node_object(tree), indent=indent, sort_keys=True)
+
+
+def create_random_forest(instances, num_trees=10, candidate_attribute_indexes=None, class_index=0, 
+                         max_features=None, seed=None, n_jobs=1, max_depth=None, min_samples_split=2, min_gain=0.0):
+    '''Returns a list of num_trees decision trees (a random forest) trained on bootstrap samples of instances.
+    
+    Each tree is trained by create_decision_tree on len(instances) instances drawn with replacement, 
+    choosing the best attribute of each node from a random sample of max_features of its candidate attributes 
+    (by default, the square root of the number of candidates); max_depth, min_samples_split and min_gain 
+    limit the growth of each tree. A bootstrap sample is a view of the encoded instances over an array 
+    of positions rather than a copy of the instances, so a forest needs little more memory than 
+    the encoded instances, one index array per tree being built and the trees.
+    
+    The samples are determined by seed, whatever the number of processes: if n_jobs is not 1, the trees 
+    are trained concurrently by a pool of n_jobs processes (-1 for one per CPU) that share the encoded instances
+    through shared memory (see create_decision_tree).'''
+    instances = encode_instances(instances)
+    if candidate_attribute_indexes is None:
+        candidate_attribute_indexes = [i for i in range(len(instances[0])) if i != class_index]
+    if max_features is None:
+        max_features = max(1, int(math.sqrt(len(candidate_attribute_indexes))))
+    random_generator = random.Random(seed)
+    seeds = [random_generator.getrandbits(64) for _ in range(num_trees)]
+    tree_arguments = (candidate_attribute_indexes, class_index, max_features, max_depth, min_samples_split, min_gain)
+    if n_jobs == 1:
+        return [_create_bootstrap_tree(instances, tree_seed, *tree_arguments) for tree_seed in seeds]
+    from concurrent.futures import ProcessPoolExecutor
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    shared_memory, shared_instances_spec = _share_instances(instances)
+    try:
+        with ProcessPoolExecutor(n_jobs, initializer=_attach_shared_instances,
+                                 initargs=(shared_instances_spec,)) as executor:
+            futures = [executor.submit(_create_bootstrap_tree, None, tree_seed, *tree_arguments) 
+                       for tree_seed in seeds]
+            return [future.result() for future in futures]
+    finally:
+        _release_shared_memory(shared_memory, unlink=True)
+
+
+def _create_bootstrap_tree(instances, seed, candidate_attribute_indexes, class_index, max_features, 
+                           max_depth, min_samples_split, min_gain):
+    '''Returns a tree of create_random_forest, trained on a bootstrap sample of instances
+    drawn by a random generator seeded with seed (which also samples the candidate attributes of each node).
+    If instances is None, the shared instances of a worker process are used.'''
+    if instances is None:
+        instances = _shared_instances
+    random_generator = random.Random(seed)
+    num_instances = len(instances)
+    sample = instances.view(random_generator.choices(range(num_instances), k=num_instances))
+    return create_decision_tree(sample, candidate_attribute_indexes, class_index, 
+                                max_depth=max_depth, min_samples_split=min_samples_split, min_gain=min_gain,
+                                max_features=max_features, random_generator=random_generator)
+
+
+def is_single_instance(instances):
+    '''Returns whether instances is a single instance (a sequence of attribute values, e.g., a tuple or a list)
+    rather than a batch of instances (a sequence of such sequences, or EncodedInstances)'''
+    if isinstance(instances, EncodedInstances) or not len(instances):
+        return False
+    return not isinstance(instances[0], (list, tuple))
+
+
+def create_prediction_pool(trees, n_jobs=-1):
+    '''Returns a pool of n_jobs processes (-1 for one per CPU) for predict_by_vote, each of which 
+    receives a copy of trees (CompiledTrees) once, when it starts; the caller shuts it down.'''
+    from concurrent.futures import ProcessPoolExecutor
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    return ProcessPoolExecutor(n_jobs, initializer=_attach_shared_trees, initargs=(trees,))
+
+
+def predict_by_vote(trees, instances, default_class=None, n_jobs=1, executor=None):
+    '''Returns a list of the class labels of instances (a list of instances or EncodedInstances)
+    predicted by a majority vote of trees (CompiledTrees, see compile_tree).
+    
+    Each tree classifies the whole batch at once (see CompiledTree.predict_batch). A tree that cannot classify 
+    an instance does not vote, and an instance that none of the trees can classify is labeled default_class.
+    If n_jobs is not 1 (or executor is provided), the trees are divided into n_jobs contiguous chunks 
+    (-1 for one per CPU), which classify the instances in the processes of executor, a pool created by 
+    create_prediction_pool(trees), so that only the encoded instances are sent to the processes 
+    (through shared memory, see create_decision_tree). If no executor is provided, 
+    a pool is created for the call; callers that predict repeatedly should create their own.'''
+    instances = encode_instances(instances)
+    if not trees or not instances:
+        return [default_class] * len(instances)
+    if n_jobs == 1 and executor is None:
+        predictions = [tree.predict_batch(instances) for tree in trees]
+    elif executor is None:
+        with create_prediction_pool(trees, n_jobs) as executor:
+            return predict_by_vote(trees, instances, default_class, n_jobs, executor)
+    else:
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        shared_memory, shared_instances_spec = _share_instances(instances)
+        try:
+            # each process predicts with a contiguous chunk of the trees, so the votes are in the same order
+            chunk_size = -(-len(trees) // n_jobs)
+            futures = [executor.submit(_shared_predictions, len(trees), start, start + chunk_size, 
+                                       shared_instances_spec) 
+                       for start in range(0, len(trees), chunk_size)]
+            predictions = [prediction for future in futures for prediction in future.result()]
+        finally:
+            _release_shared_memory(shared_memory, unlink=True)
+    class_labels = []
+    for votes in zip(*predictions):
+        vote_counts = Counter(votes)
+        vote_counts.pop(None, None)
+        class_labels.append(vote_counts.most_common(1)[0][0] if vote_counts else default_class)
+    return class_labels
+
+
+_shared_trees = None  # in a worker process of create_prediction_pool, its copy of the trees
+
+
+def _attach_shared_trees(trees):
+    '''Initializes a worker process of create_prediction_pool with its copy of trees'''
+    global _shared_trees
+    _shared_trees = trees
+
+
+def _shared_predictions(num_trees, start, end, shared_instances_spec):
+    '''Returns a list of the predictions of each of the worker process's trees[start:end] (CompiledTrees)
+    for the instances in the shared memory block described by shared_instances_spec (see _share_instances)'''
+    if _shared_trees is None or len(_shared_trees) != num_trees:
+        raise ValueError('the pool was not created by create_prediction_pool for these trees')
+    from multiprocessing.shared_memory import SharedMemory
+    shared_memory = SharedMemory(shared_instances_spec[0])
+    try:
+        instances = _attach_instances(shared_memory, shared_instances_spec)
+        return [tree.predict_batch(instances) for tree in _shared_trees[start:end]]
+    finally:
+        instances = None
+        _release_shared_memory(shared_memory)
 
 
 def classification_accuracy(tree, testing_instances, class_index=0):
@@ -362,22 +2437,69 @@ def classification_accuracy(tree, testing_instances, class_index=0):
     return num_correct / len(testing_instances)
     
 
-def compute_learning_curve(instances, num_partitions=10):
-    '''Returns a list of training sizes and scores for incrementally increasing partitions.
+def compute_learning_curve(instances, num_partitions=10, cross_validate=False, n_jobs=1):
+    '''Returns a list of training sizes, scores and times for incrementally increasing partitions.
     
-    The list contains 2-element tuples, each representing a training size and score.
+    The list contains 3-element tuples, each representing a training size, score and time.
     The i-th training size is the number of instances in partitions 0 through num_partitions - 2.
     The i-th score is the accuracy of a tree trained with instances 
     from partitions 0 through num_partitions - 2
-    and tested on instances from num_partitions - 1 (the last partition).'''
-    partitions = partition_instances(instances, num_partitions)
-    testing_instances = partitions[-1][:]
-    training_instances = partitions[0][:]
-    accuracy_list = []
-    for i in range(1, num_partitions):
-        # for each iteration, the training set is composed of partitions 0 through i - 1
-        tree = create_decision_tree(training_instances)
-        partition_accuracy = classification_accuracy(tree, testing_instances)
-        accuracy_list.append((len(training_instances), partition_accuracy))
-        training_instances.extend(partitions[i][:])
-    return accuracy_list
+    and tested on instances from num_partitions - 1 (the last partition).
+    The i-th time is the number of seconds taken to train and test that tree.
+    
+    If cross_validate is True, each partition is used in turn as the testing partition
+    (k-fold cross-validation, with k = num_partitions), with the training partitions added in order 
+    from the others, and each training size, score and time is the average over the k folds.
+    
+    The instances are encoded once (see EncodedInstances), and each step trains and tests on views 
+    of the encoded instances rather than on copies of the partitions. If n_jobs is not 1, the steps are run 
+    concurrently by a pool of n_jobs processes (-1 for one per CPU) that share the encoded instances 
+    through shared memory (see create_decision_tree).'''
+    instances = encode_instances(instances)
+    test_partitions = range(num_partitions) if cross_validate else [num_partitions - 1]
+    steps = [(test_partition, num_training_partitions) 
+             for test_partition in test_partitions 
+             for num_training_partitions in range(1, num_partitions)]
+    if n_jobs == 1:
+        results = [_learning_curve_step(instances, num_partitions, test_partition, num_training_partitions)
+                   for test_partition, num_training_partitions in steps]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        shared_memory, shared_instances_spec = _share_instances(instances)
+        try:
+            with ProcessPoolExecutor(n_jobs, initializer=_attach_shared_instances,
+                                     initargs=(shared_instances_spec,)) as executor:
+                futures = [executor.submit(_learning_curve_step, None, num_partitions, 
+                                           test_partition, num_training_partitions)
+                           for test_partition, num_training_partitions in steps]
+                results = [future.result() for future in futures]
+        finally:
+            _release_shared_memory(shared_memory, unlink=True)
+    # average the results of each step over the folds (if any)
+    num_folds = len(test_partitions)
+    if num_folds == 1:
+        return results
+    return [tuple(sum(values) / num_folds for values in zip(*results[step::num_partitions - 1]))
+            for step in range(num_partitions - 1)]
+
+
+def _learning_curve_step(instances, num_partitions, test_partition, num_training_partitions):
+    '''Returns the training size, accuracy and time for one step of compute_learning_curve:
+    training a tree on the first num_training_partitions partitions of instances other than test_partition,
+    and testing it on test_partition. If instances is None, the shared instances of a worker process are used.'''
+    start_time = default_timer()
+    if instances is None:
+        instances = _shared_instances
+    num_instances = len(instances)
+    training_partitions = [i for i in range(num_partitions) if i != test_partition][:num_training_partitions]
+    # the instances are laid out as in the lists returned by partition_instances
+    training_instances = instances.view(j for i in training_partitions for j in range(i, num_instances, num_partitions))
+    testing_instances = instances.view(range(test_partition, num_instances, num_partitions))
+    tree = create_decision_tree(training_instances)
+    predictions = compile_tree(tree, instances.vocabularies).predict_batch(testing_instances)
+    class_vocabulary = instances.vocabularies[0]
+    num_correct = sum(1 for prediction, code in zip(predictions, testing_instances.column_codes(0)) 
+                      if prediction == class_vocabulary[code])
+    return len(training_instances), num_correct / len(testing_instances), default_timer() - start_time
@@ -0,0 +1,320 @@
+from __future__ import print_function, division
+
+''' An asyncio server that classifies instances with a SimpleDecisionTree saved by SimpleDecisionTree.save(),
+combining concurrent requests into batches
+
+Usage example:
+    python simple_prediction_server.py mushrooms.tree --port 8000 --max-latency 0.005
+
+Requests are JSON objects, sent either as the body of an HTTP POST to /predict,
+or as single lines over a plain connection (TCP, or a Unix domain socket):
+    {"instance": ["?", "x", "s", "n", ...]}             -> {"prediction": "e"}
+    {"instances": [["?", "x", "s", "n", ...], ...]}     -> {"predictions": ["e", ...]}
+    {"stats": true} (or HTTP GET /stats)                -> the statistics of the server
+Each instance is a list of attribute values laid out like the instances the tree was trained on
+(the value in the position of the class label is ignored).
+'''
+
+__author__ = 'Joe McCarthy'
+__email__ = 'joe@interrelativity.com'
+
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from collections import deque
+from timeit import default_timer
+
+from simple_decision_tree import SimpleDecisionTree
+
+
+class PredictionServer(object):
+    '''Classifies the instances of concurrent requests in micro-batches with a SimpleDecisionTree.
+
+    The first request to arrive when no batch is being collected starts a new batch, which collects
+    the instances of the requests that arrive in the next max_latency seconds (or until it has
+    max_batch_size instances). The batch is classified by SimpleDecisionTree.predict_batch in a thread,
+    while the next batch is collected.
+
+    The model file is checked every reload_interval seconds, and when it has been replaced
+    (e.g., by another call to SimpleDecisionTree.save), the new tree is loaded and used for the next batch;
+    requests already in a batch are classified by the tree that was current when the batch started.'''
+
+    def __init__(self, model_filename, max_latency=0.005, max_batch_size=1024, reload_interval=1.0,
+                 num_latencies=10000):
+        self.model_filename = model_filename
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self.reload_interval = reload_interval
+        self.decision_tree = SimpleDecisionTree.load(model_filename)
+        self._model_signature = self._file_signature()
+        self._queue = None  # created in the server's event loop by start(), as is
+        self._batch_full = None  # an event set when enough instances are waiting to fill a batch
+        self._tasks = []
+        self._num_pending_instances = 0
+        self._latencies = deque(maxlen=num_latencies)  # the seconds taken by the most recent requests
+        self.num_requests = 0
+        self.num_instances = 0
+        self.num_batches = 0
+        self.num_reloads = 0
+        self.num_reload_errors = 0
+
+    def _file_signature(self):
+        # a file replaced by os.replace has a new inode, even if its size and time are unchanged
+        status = os.stat(self.model_filename)
+        return status.st_ino, status.st_size, status.st_mtime_ns
+
+    def start(self):
+        '''Starts the tasks that collect batches and reload the model (in the running event loop)'''
+        self._queue = asyncio.Queue()
+        self._batch_full = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._classify_batches())]
+        if self.reload_interval:
+            self._tasks.append(asyncio.ensure_future(self._reload_model()))
+
+    async def stop(self):
+        '''Cancels the tasks started by start()'''
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def predict(self, instances):
+        '''Returns the predicted class labels of a list of instances, once the batch they join is classified'''
+        instances = [list(instance) for instance in instances]
+        width = len(self.decision_tree._vocabularies)
+        if any(len(instance) < width for instance in instances):
+            raise ValueError('each instance must have (at least) {} attribute values'.format(width))
+        # checked before the instances join a batch, so that they cannot fail the requests of other clients
+        if not all(value is None or isinstance(value, str) for instance in instances for value in instance):
+            raise ValueError('each attribute value must be a string (or null)')
+        future = asyncio.get_running_loop().create_future()
+        self._num_pending_instances += len(instances)
+        self._queue.put_nowait((instances, future, default_timer()))
+        if self._num_pending_instances >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _classify_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self._queue.get()]
+            batch_size = len(requests[0][0])
+            if batch_size < self.max_batch_size:
+                try:  # wait for more requests (waiting on the queue itself could lose a request on timeout)
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_latency)
+                except asyncio.TimeoutError:
+                    pass
+            while batch_size < self.max_batch_size and not self._queue.empty():
+                request = self._queue.get_nowait()
+                requests.append(request)
+                batch_size += len(request[0])
+            instances = [instance for request in requests for instance in request[0]]
+            self._num_pending_instances -= len(instances)
+            if self._num_pending_instances < self.max_batch_size:
+                self._batch_full.clear()
+            decision_tree = self.decision_tree  # a reload during this batch only affects the next one
+            try:
+                predictions = await loop.run_in_executor(None, decision_tree.predict_batch, instances)
+            except Exception as exception:
+                for _, future, _ in requests:
+                    if not future.done():
+                        future.set_exception(exception)
+                continue
+            end_time = default_timer()
+            start = 0
+            for request_instances, future, start_time in requests:
+                if not future.done():  # the client may have gone away
+                    future.set_result(predictions[start:start + len(request_instances)])
+                start += len(request_instances)
+                self._latencies.append(end_time - start_time)
+            self.num_requests += len(requests)
+            self.num_instances += len(instances)
+            self.num_batches += 1
+
+    async def _reload_model(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                signature = self._file_signature()
+                if signature != self._model_signature:
+                    self.decision_tree = await loop.run_in_executor(None, SimpleDecisionTree.load,
+                                                                    self.model_filename)
+                    self._model_signature = signature
+                    self.num_reloads += 1
+            except (OSError, ValueError, KeyError) as error:
+                # a missing or unreadable file is tried again later; the current tree is kept meanwhile
+                self.num_reload_errors += 1
+                print('Unable to reload {}: {}'.format(self.model_filename, error), file=sys.stderr)
+
+    def stats(self):
+        '''Returns a dictionary of statistics: the queue depth (the numbers of requests and instances waiting
+        to join a batch), counts of requests, instances, batches and reloads, and the 50th, 90th and 99th
+        percentiles of the latencies (in seconds) of the most recent requests'''
+        latencies = sorted(self._latencies)
+        percentiles = {}
+        for percentile in (50, 90, 99):
+            percentiles['p{}'.format(percentile)] = (latencies[min(len(latencies) - 1,
+                                                                   len(latencies) * percentile // 100)]
+                                                     if latencies else None)
+        return {'queued_requests': self._queue.qsize() if self._queue is not None else 0,
+                'queued_instances': self._num_pending_instances,
+                'requests': self.num_requests,
+                'instances': self.num_instances,
+                'batches': self.num_batches,
+                'mean_batch_size': self.num_instances / self.num_batches if self.num_batches else None,
+                'reloads': self.num_reloads,
+                'reload_errors': self.num_reload_errors,
+                'latency': percentiles}
+
+    async def respond(self, request):
+        '''Returns the response (a JSON-compatible object) to a request (see the module documentation)'''
+        if not isinstance(request, dict):
+            raise ValueError('a request must be a JSON object')
+        if 'instances' in request:
+            return {'predictions': await self.predict(request['instances'])}
+        if 'instance' in request:
+            return {'prediction': (await self.predict([request['instance']]))[0]}
+        if request.get('stats'):
+            return self.stats()
+        raise ValueError('a request must contain "instance", "instances" or "stats"')
+
+    async def handle_connection(self, reader, writer):
+        '''Responds to the requests of a connection: HTTP requests if the first line is an HTTP request line,
+        otherwise one JSON request per line'''
+        http = False
+        try:
+            line = await reader.readline()
+            if line.split(b' ', 1)[0] in (b'GET', b'POST'):
+                http = True
+                while line:
+                    if not await self._respond_to_http(line, reader, writer):
+                        break
+                    line = await reader.readline()
+            else:
+                while line:
+                    if line.strip():
+                        try:
+                            response = await self.respond(json.loads(line.decode('utf-8')))
+                        except Exception as error:
+                            response = {'error': str(error)}
+                        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                        await writer.drain()
+                    line = await reader.readline()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except (ValueError, asyncio.LimitOverrunError):
+            # a line (or header) longer than the limit of the stream (see serve): the rest of the line 
+            # cannot be told apart from the next request, so the error is reported and the connection closed
+            error = {'error': 'a line of the request is longer than the limit of the server'}
+            try:
+                if http:
+                    await self._write_http_response(writer, 'HTTP/1.1', '400 Bad Request', error, False)
+                else:
+                    writer.write(json.dumps(error).encode('utf-8') + b'\n')
+                    await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _respond_to_http(self, request_line, reader, writer):
+        # responds to one HTTP request, and returns whether the connection should be kept open
+        request_fields = request_line.decode('latin-1').split()
+        if len(request_fields) != 3 or not request_fields[2].startswith('HTTP/'):
+            # without a valid request line, the rest of the connection cannot be trusted to be HTTP
+            return await self._write_http_response(writer, 'HTTP/1.1', '400 Bad Request', 
+                                                   {'error': 'malformed request line'}, False)
+        method, path, version = request_fields
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            # the end of the body (and the start of the next request) is unknown, so the connection is closed
+            return await self._write_http_response(writer, version, '400 Bad Request', 
+                                                   {'error': 'invalid content-length {}'.format(
+                                                       headers['content-length'])},
+                                                   False)
+        body = await reader.readexactly(content_length)
+        status = '200 OK'
+        try:
+            if method == 'GET' and path == '/stats':
+                response = self.stats()
+            elif method == 'POST' and path == '/predict':
+                response = await self.respond(json.loads(body.decode('utf-8')))
+            else:
+                status, response = '404 Not Found', {'error': 'unknown path {}'.format(path)}
+        except (ValueError, TypeError) as error:
+            status, response = '400 Bad Request', {'error': str(error)}
+        except Exception as error:  # e.g., a failure to classify the batch of the request
+            status, response = '500 Internal Server Error', {'error': str(error)}
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        return await self._write_http_response(writer, version, status, response, keep_alive)
+
+    async def _write_http_response(self, writer, version, status, response, keep_alive):
+        # writes an HTTP response with a JSON body, and returns keep_alive
+        body = json.dumps(response).encode('utf-8')
+        writer.write('{} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+            version, status, len(body), 'keep-alive' if keep_alive else 'close').encode('latin-1') + body)
+        await writer.drain()
+        return keep_alive
+
+
+async def serve(prediction_server, host='127.0.0.1', port=8000, unix_path=None, backlog=1024, limit=2 ** 24):
+    '''Runs prediction_server until it is cancelled, accepting connections on host and port
+    (or, if unix_path is provided, on a Unix domain socket with that path), with up to backlog connections
+    waiting to be accepted. 
+    
+    A line of a request (e.g., a JSON request, or an HTTP header) can be up to limit bytes long 
+    (16 MiB by default, i.e., a few hundred thousand mushroom instances).'''
+    prediction_server.start()
+    if unix_path:
+        server = await asyncio.start_unix_server(prediction_server.handle_connection, unix_path, 
+                                                 backlog=backlog, limit=limit)
+    else:
+        server = await asyncio.start_server(prediction_server.handle_connection, host, port, 
+                                            backlog=backlog, limit=limit)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await prediction_server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the predictions of a saved SimpleDecisionTree')
+    parser.add_argument('model', help='a file saved by SimpleDecisionTree.save()')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help='the path of a Unix domain socket to listen on instead of a port')
+    parser.add_argument('--backlog', type=int, default=1024, help='the number of connections that can wait')
+    parser.add_argument('--limit', type=int, default=2 ** 24, 
+                        help='the maximum length (in bytes) of a line of a request')
+    parser.add_argument('--max-latency', type=float, default=0.005,
+                        help='seconds to wait for more requests to add to a batch')
+    parser.add_argument('--max-batch-size', type=int, default=1024)
+    parser.add_argument('--reload-interval', type=float, default=1.0,
+                        help='seconds between checks for a new model file (0 to never reload)')
+    args = parser.parse_args(argv)
+    prediction_server = PredictionServer(args.model, args.max_latency, args.max_batch_size, args.reload_interval)
+    try:
+        asyncio.run(serve(prediction_server, args.host, args.port, args.unix_socket, args.backlog, args.limit))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from __future__ import print_function, division
+
+''' A class to implement a simple random forest (an ensemble of simple decision trees)
+'''
+
+__author__ = 'Joe McCarthy'
+__email__ = 'joe@interrelativity.com'
+
+
+from collections import Counter
+from simple_ml import encode_instances, create_random_forest, compile_tree, predict_by_vote, is_single_instance
+from simple_ml import create_prediction_pool
+
+
+class SimpleRandomForest:
+
+
+    _trees = []  # the trees, in the nested dictionary representation used by simple_ml.create_decision_tree
+    _compiled_trees = []  # the flattened versions of _trees used by predict()
+    _target_attribute_index = 0
+    _default_class = None
+    _executor = None  # the pool of processes (holding the trees) used by predict() if n_jobs is not 1
+
+
+    def __init__(self, num_trees=10, max_features=None, seed=None, n_jobs=1,
+                 max_depth=None, min_samples_split=2, min_gain=0.0):
+        # see simple_ml.create_random_forest for the meaning of each parameter
+        self.num_trees = num_trees
+        self.max_features = max_features
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_gain = min_gain
+
+    def fit(self,
+            instances,
+            candidate_attribute_indexes=None,
+            target_attribute_index=0,
+            default_class=None):
+        '''
+        Build a random forest of num_trees decision trees that best fits the data in instances.
+
+        Each tree is trained on a bootstrap sample of instances (drawn with replacement),
+        and the attribute of each of its nodes is the best of a random sample of max_features
+        of the candidate_attribute_indexes (which defaults to all indexes other than target_attribute_index).
+        The samples are views of the instances, encoded once, rather than copies of them.
+        The default_class is predicted for instances that none of the trees can classify.
+        '''
+        self.close()  # the processes of the pool hold the old trees
+        instances = encode_instances(instances)
+        self._target_attribute_index = target_attribute_index
+        self._default_class = default_class
+        self._trees = create_random_forest(instances,
+                                           self.num_trees,
+                                           candidate_attribute_indexes,
+                                           target_attribute_index,
+                                           self.max_features,
+                                           self.seed,
+                                           self.n_jobs,
+                                           self.max_depth,
+                                           self.min_samples_split,
+                                           self.min_gain)
+        self._compiled_trees = [compile_tree(tree, instances.vocabularies) for tree in self._trees]
+
+
+    def predict(self, instances, default_class=None):
+        '''Return the predicted class label(s) of instance(s), by a majority vote of the trees.
+
+        A list of instances (or EncodedInstances) is classified as a batch by each tree in turn
+        (in parallel, if n_jobs is not 1, in a pool of processes that receive the trees once,
+        and are reused by later calls until close() or fit()).'''
+        if default_class is None:
+            default_class = self._default_class
+        if is_single_instance(instances):
+            return predict_by_vote(self._compiled_trees, [instances], default_class)[0]
+        if self.n_jobs == 1:
+            return predict_by_vote(self._compiled_trees, instances, default_class)
+        if self._executor is None:
+            self._executor = create_prediction_pool(self._compiled_trees, self.n_jobs)
+        return predict_by_vote(self._compiled_trees, instances, default_class, self.n_jobs, self._executor)
+
+
+    def close(self):
+        '''Shut down the pool of processes used by predict(), if any'''
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+    def __getstate__(self):
+        # the pool of processes cannot be pickled, so an unpickled forest creates its own
+        state = self.__dict__.copy()
+        state.pop('_executor', None)
+        return state
+
+
+    def classification_accuracy(self, instances, default_class=None):
+        '''Return a tuple with
+        the proportion of instances that were correctly classified,
+        the number of correctly classified instances,
+        the number of incorrectly classified instances
+        '''
+        predicted_labels = self.predict(instances, default_class)
+        actual_labels = [x[self._target_attribute_index] for x in instances]
+        counts = Counter([x == y for x, y in zip(predicted_labels, actual_labels)])
+        return counts[True] / len(instances), counts[True], counts[False]